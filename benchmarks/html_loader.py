@@ -0,0 +1,170 @@
+# benchmarks/html_loader.py
+#
+# Copyright 2025 Christophe Gueret
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Compare the loading of scenes with parse_html to the BeautifulSoup loader
+it replaced.
+
+Run it from the root of the repository:
+
+    python benchmarks/html_loader.py [--words 30000] [--repeat 5]
+
+The parsing alone is always measured. The BeautifulSoup side needs bs4 and
+filling a text buffer needs Gtk, each is skipped if not installed.
+"""
+
+from pathlib import Path
+import argparse
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from scriptorium.utils import parse_html  # noqa: E402
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing",
+         "elit", "sed", "do", "eiusmod", "tempor", "incididunt", "labore"]
+
+
+def make_scene(words: int, seed: int = 0) -> str:
+    """Return the HTML of a scene of about that many words, with some of
+    them in italic or bold."""
+    rng = random.Random(seed)
+    paragraphs = []
+    count = 0
+    while count < words:
+        fragments = []
+        for _ in range(rng.randint(40, 120)):
+            word = rng.choice(WORDS)
+            style = rng.random()
+            if style < 0.05:
+                word = f"<em>{word}</em>"
+            elif style < 0.08:
+                word = f"<strong>{word}</strong>"
+            fragments.append(word)
+            count += 1
+        paragraphs.append(f"<p>{' '.join(fragments)}</p>")
+    return "\n".join(paragraphs)
+
+
+def bs4_parse(html_content: str) -> list:
+    """The parsing done by the BeautifulSoup loader, without the buffer."""
+    from bs4 import BeautifulSoup
+
+    fragments = []
+    soup = BeautifulSoup(html_content, 'html.parser')
+    for paragraph in soup.find_all('p'):
+        for child in paragraph.children:
+            text = child.get_text()
+            if len(text) > 1:
+                fragments.append((text, child.name))
+        fragments.append(("\n\n", None))
+    return fragments
+
+
+def bs4_html_to_buffer(html_content: str, buffer):
+    """The BeautifulSoup loader, as it was before parse_html."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html_content, 'html.parser')
+    paragraphs = soup.find_all('p')
+    for paragraph in paragraphs:
+        for child in paragraph.children:
+            text = child.get_text()
+            if len(text) > 1:
+                start = buffer.get_end_iter()
+                if child.name:
+                    buffer.insert_with_tags_by_name(start, text, child.name)
+                else:
+                    buffer.insert(start, text)
+        start = buffer.get_end_iter()
+        buffer.insert(start, "\n\n")
+    buffer.place_cursor(buffer.get_start_iter())
+
+
+def measure(function, repeat: int) -> float:
+    """Return the best time of a few runs of the function, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name: str, seconds: float, reference: float = None):
+    line = f"  {name:<28} {seconds * 1000:9.1f} ms"
+    if reference is not None:
+        line += f"  ({reference / seconds:.1f}x faster)"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--words", type=int, default=30000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    html_content = make_scene(args.words)
+    print(f"Scene of {args.words} words, {len(html_content)} characters")
+
+    try:
+        import bs4  # noqa: F401
+    except ImportError:
+        bs4 = None
+
+    print("Parsing:")
+    parse_time = measure(lambda: parse_html(html_content), args.repeat)
+    if bs4 is None:
+        report("parse_html", parse_time)
+        print("  BeautifulSoup skipped, bs4 is not installed")
+    else:
+        bs4_time = measure(lambda: bs4_parse(html_content), args.repeat)
+        report("BeautifulSoup", bs4_time)
+        report("parse_html", parse_time, bs4_time)
+
+    try:
+        import gi
+        gi.require_version("Gtk", "4.0")
+        from gi.repository import Gtk
+        from scriptorium.utils.text_buffer import html_to_buffer
+    except (ImportError, ValueError):
+        print("Filling a buffer skipped, Gtk is not available")
+        return
+
+    tag_table = Gtk.TextTagTable()
+    for name in ["em", "strong"]:
+        tag_table.add(Gtk.TextTag(name=name))
+
+    def fill(loader):
+        loader(html_content, Gtk.TextBuffer(tag_table=tag_table))
+
+    print("Filling a buffer:")
+    load_time = measure(lambda: fill(html_to_buffer), args.repeat)
+    if bs4 is None:
+        report("html_to_buffer", load_time)
+    else:
+        bs4_time = measure(lambda: fill(bs4_html_to_buffer), args.repeat)
+        report("BeautifulSoup", bs4_time)
+        report("html_to_buffer", load_time, bs4_time)
+
+
+if __name__ == "__main__":
+    main()
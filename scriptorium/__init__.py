@@ -1,8 +1,27 @@
 # Set the target version of the libraries
-import gi
-gi.require_version("Gtk", "4.0")
-gi.require_version("Adw", "1")
-gi.require_version("Tsparql", "3.0")
-gi.require_version("WebKit", "6.0")
-gi.require_version("Soup", '3.0')
+try:
+    import gi
+except ImportError:
+    # Without PyGObject only the helpers which need no library can be used,
+    # for instance to run the tests and benchmarks of scriptorium.utils
+    gi = None
+
+LIBRARY_VERSIONS = [
+    ("Gtk", "4.0"),
+    ("GdkPixbuf", "2.0"),
+    ("Adw", "1"),
+    ("Tsparql", "3.0"),
+    ("WebKit", "6.0"),
+    ("Soup", "3.0"),
+]
+
+for namespace, version in LIBRARY_VERSIONS:
+    if gi is None:
+        break
+    try:
+        gi.require_version(namespace, version)
+    except ValueError:
+        # Not installed, for instance on a headless system. Modules using
+        # that library will fail to import instead of the whole package.
+        pass
 
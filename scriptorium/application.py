@@ -20,6 +20,7 @@ from scriptorium.dialogs import ScrptPreferencesDialog
 from gi.repository import Gio, Adw, GLib, GObject
 from .window import ScrptWindow
 from .language_tool import LanguageTool
+from .utils.storage import describe_write_statistics
 import logging
 
 logging.basicConfig(
@@ -140,4 +141,7 @@ class ScriptoriumApplication(Adw.Application):
         # Instantiate our language tool interface
         self.language_tool.shutdown()
 
+        # Report how long saving the projects took during the session
+        logger.info(describe_write_statistics())
+
 
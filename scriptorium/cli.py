@@ -0,0 +1,322 @@
+# cli.py
+#
+# Copyright 2025 Christophe Guéret
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Headless command line interface to process projects without the UI."""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib import parse, request
+import argparse
+import json
+import logging
+
+from gi.repository import Gio, GLib
+
+from scriptorium.models import Project, Chapter
+from scriptorium.utils import html_to_text
+from scriptorium.utils.storage import (
+    describe_write_statistics, reset_write_statistics
+)
+
+logger = logging.getLogger(__name__)
+
+# The commands handled by the command line interface
+COMMANDS = ["publish", "stats", "migrate", "check", "grammar"]
+
+# The compiled resources, installed next to the Python package
+RESOURCE_PATH = Path(__file__).parent.parent / "scriptorium.gresource"
+
+DEFAULT_LANGUAGE_TOOL_URL = "http://localhost:8081"
+
+# Seconds to wait for LanguageTool to reply about one scene
+DEFAULT_LANGUAGE_TOOL_TIMEOUT = 30
+
+# The file describing a project, found at the root of its directory
+PROJECT_FILE = "manuscript.yml"
+
+
+def _init_worker():
+    """Make sure the compiled resources are available in a worker."""
+    try:
+        Gio.resources_get_info("/com/github/cgueret/Scriptorium", 0)
+    except GLib.GError:
+        if RESOURCE_PATH.exists():
+            Gio.Resource.load(str(RESOURCE_PATH))._register()
+
+
+def _is_project(path: Path) -> bool:
+    """Tell if a directory contains a project."""
+    return (path / PROJECT_FILE).is_file()
+
+
+def _load_project(project_path: str) -> Project:
+    """Load the project at a path, without creating one if there is none."""
+    if not _is_project(Path(project_path)):
+        raise ValueError(f"not a project, there is no {PROJECT_FILE}")
+    return Project(project_path)
+
+
+def _open_project(project_path: str) -> Project:
+    """Open the project at a path, failing if it needs a migration."""
+    project = _load_project(project_path)
+    if not project.can_be_opened:
+        raise ValueError("the project needs to be migrated first")
+    project.open()
+    return project
+
+
+def publish_project(project_path: str, target_files: dict):
+    """Build the EPUB of a project, into its file from the target files."""
+    from scriptorium.utils.publisher import Publisher
+
+    project = _open_project(project_path)
+    target_file = target_files[project_path]
+    Publisher(project.manuscript).save(target_file)
+
+    return [f"Saved {target_file}"]
+
+
+def project_stats(project_path: str) -> dict:
+    """Count the content of a project."""
+    project = _open_project(project_path)
+    manuscript = project.manuscript
+
+    chapters = [r for r in project.resources if isinstance(r, Chapter)]
+    words = 0
+    for scene in manuscript.iter_scenes():
+        words += len(html_to_text(scene.to_html()).split())
+
+    return {
+        "title": project.title,
+        "chapters": len(chapters),
+        "scenes": len(project.scenes),
+        "entities": len(project.entities),
+        "images": len(project.images),
+        "words": words,
+    }
+
+
+def migrate_project(project_path: str):
+    """Snapshot and migrate a project."""
+    project = _load_project(project_path)
+    if project.can_be_opened:
+        return ["Already up to date"]
+
+    # Only report the writes of this project, workers handle several
+    reset_write_statistics()
+
+    snapshot = project.create_snapshot()
+    if not project.migrate():
+        raise ValueError(project.migration_error or "migration failed")
+
+    return [
+        f"Migrated, snapshot saved as {snapshot}",
+        describe_write_statistics()
+    ]
+
+
+def check_project(project_path: str):
+    """Run the integrity checks on a project."""
+    issues = _load_project(project_path).check_integrity()
+    if len(issues) > 0:
+        raise ValueError("\n".join(issues))
+
+    return ["No issue found"]
+
+
+def grammar_check_project(project_path: str, server: str, language: str,
+                          timeout: float = DEFAULT_LANGUAGE_TOOL_TIMEOUT):
+    """Check all the scenes of a project against a LanguageTool server,
+    failing if it does not reply to one of them within the timeout."""
+    from scriptorium.language_tool import parse_check_result
+
+    project = _open_project(project_path)
+
+    lines = []
+    for scene in project.manuscript.iter_scenes():
+        text = html_to_text(scene.to_html())
+        if text.strip() == "":
+            continue
+
+        payload = parse.urlencode({"text": text, "language": language})
+        try:
+            with request.urlopen(
+                f"{server}/v2/check", payload.encode(), timeout=timeout
+            ) as reply:
+                annotations = parse_check_result(json.loads(reply.read()))
+        except OSError as e:
+            # Timeouts and connection errors alike, the other projects are
+            # still checked
+            raise ValueError(f"{scene.title}: no reply from {server}: {e}")
+
+        for annotation in annotations:
+            excerpt = text[annotation.offset:annotation.offset + annotation.length]
+            lines.append(
+                f"{scene.title}: {annotation.category}: "
+                f"\"{excerpt}\" {annotation.message}"
+            )
+
+    lines.append(f"{len(lines)} annotations")
+    return lines
+
+
+def _run_for_projects(function, projects, *args) -> int:
+    """Run a function for every project in parallel and report on it."""
+    failures = 0
+    with ProcessPoolExecutor(initializer=_init_worker) as executor:
+        futures = [
+            executor.submit(function, project, *args) for project in projects
+        ]
+
+        # Report in the order the projects were given
+        for project, future in zip(projects, futures):
+            try:
+                lines = future.result()
+                print(f"{project}: OK")
+            except Exception as e:
+                failures += 1
+                lines = str(e).split("\n")
+                print(f"{project}: FAILED")
+            for line in lines:
+                print(f"  {line}")
+
+    return 1 if failures > 0 else 0
+
+
+def _print_stats(projects) -> int:
+    """Print the statistics of every project and of the whole library."""
+    totals = {}
+    failures = 0
+    with ProcessPoolExecutor(initializer=_init_worker) as executor:
+        futures = [executor.submit(project_stats, p) for p in projects]
+        for project, future in zip(projects, futures):
+            try:
+                stats = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"{project}: FAILED\n  {e}")
+                continue
+
+            print(f"{project}: {stats.pop('title')}")
+            for key, value in stats.items():
+                print(f"  {key:<10} {value}")
+                totals[key] = totals.get(key, 0) + value
+
+    print(f"Library: {len(projects) - failures} projects")
+    for key, value in totals.items():
+        print(f"  {key:<10} {value}")
+
+    return 1 if failures > 0 else 0
+
+
+def _expand_projects(paths, library):
+    """Return the list of project paths to process."""
+    projects = [str(Path(p).resolve()) for p in paths]
+    if library is not None:
+        for directory in sorted(Path(library).iterdir()):
+            if directory.is_dir() and _is_project(directory):
+                projects.append(str(directory.resolve()))
+    return projects
+
+
+def _target_files(projects, output_directory) -> dict:
+    """Return the EPUB file to write for every project, named after the
+    directory of the project and never the same for two of them."""
+    target_files = {}
+    used = set()
+    for project in projects:
+        name = Path(project).name
+        suffix = 1
+        while name in used:
+            suffix += 1
+            name = f"{Path(project).name}-{suffix}"
+        used.add(name)
+        target_files[project] = str(Path(output_directory) / f"{name}.epub")
+    return target_files
+
+
+def _build_parser():
+    """Create the parser for the arguments of the command line."""
+    parser = argparse.ArgumentParser(
+        prog="scriptorium",
+        description="Process Scriptorium projects without opening a window."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    helps = {
+        "publish": "build the EPUB of the projects",
+        "stats": "print statistics about the projects",
+        "migrate": "migrate the projects to the current format",
+        "check": "check the integrity of the projects",
+        "grammar": "check the text of the projects with LanguageTool",
+    }
+    for command in COMMANDS:
+        subparser = commands.add_parser(command, help=helps[command])
+        subparser.add_argument(
+            "projects", nargs="*",
+            help="the directories of the projects"
+        )
+        subparser.add_argument(
+            "--library",
+            help="also process every project in this library directory"
+        )
+        if command == "publish":
+            subparser.add_argument(
+                "--output", default=".",
+                help="the directory where to save the EPUB files"
+            )
+        if command == "grammar":
+            subparser.add_argument(
+                "--server", default=DEFAULT_LANGUAGE_TOOL_URL,
+                help="the URL of the LanguageTool server"
+            )
+            subparser.add_argument(
+                "--language", default="en-GB",
+                help="the language of the text"
+            )
+            subparser.add_argument(
+                "--timeout", type=float, default=DEFAULT_LANGUAGE_TOOL_TIMEOUT,
+                help="the seconds to wait for the server to check a scene"
+            )
+
+    return parser
+
+
+def run(arguments) -> int:
+    """Run the command line interface and return the exit code."""
+    args = _build_parser().parse_args(arguments)
+    projects = _expand_projects(args.projects, args.library)
+    if len(projects) == 0:
+        print("No project to process")
+        return 1
+
+    if args.command == "publish":
+        return _run_for_projects(
+            publish_project, projects, _target_files(projects, args.output)
+        )
+    elif args.command == "stats":
+        return _print_stats(projects)
+    elif args.command == "migrate":
+        return _run_for_projects(migrate_project, projects)
+    elif args.command == "check":
+        return _run_for_projects(check_project, projects)
+    elif args.command == "grammar":
+        return _run_for_projects(
+            grammar_check_project, projects, args.server, args.language,
+            args.timeout
+        )
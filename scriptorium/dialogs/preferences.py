@@ -19,7 +19,7 @@
 """Dialog to select scenes in Scriptorium."""
 from gi.repository import Adw, Gtk, Gio, Pango
 from scriptorium.globals import BASE
-from scriptorium.utils import html_to_buffer
+from scriptorium.utils.text_buffer import html_to_buffer
 
 import logging
 
@@ -19,16 +19,357 @@
 #
 # Code inspired from https://github.com/sonnyp/Eloquent/blob/main/src/languagetool.js
 from gi.repository import Gio, GObject, Soup, GLib
+from bisect import bisect_right
+from pathlib import Path
+import hashlib
 import json
 import logging
-from scriptorium.models import Annotation
+import sqlite3
+import time
+from scriptorium.models import Match
 
 logger = logging.getLogger(__name__)
 
 SEND_PING_TIMEOUT_SECONDS = 1
 
+# Maximum number of check requests sent to the server at the same time
+MAX_RUNNING_CHECKS = 2
+
+# Maximum number of paragraphs kept in the cache of check results
+CACHE_MAX_ENTRIES = 50000
+
+# Number of paragraphs whose results a checker keeps in memory, the others
+# are found in the cache
+CHECKER_MAX_RESULTS = 2000
+
+# Share of the maximum number of entries kept when evicting, so that the
+# eviction is done for many entries at once
+CACHE_EVICTION_RATIO = 0.9
+
+# Number of keys looked up in a single query
+CACHE_LOOKUP_BATCH = 500
+
+# Characters replaced by a simple space before hashing a paragraph
+SPACES = str.maketrans({"\u00a0": " ", "\u2007": " ", "\u202f": " ", "\t": " "})
+
 # TODO Replace pings with a passive check, update alive everytime asked
 
+
+def parse_check_result(results: dict) -> list:
+    """Turn the JSON reply of a check request into a list of matches."""
+
+    # Prepare a list of matches
+    matches = []
+    for match in results['matches']:
+        # Set the message
+        title = match["shortMessage"]
+        if len(match["shortMessage"]) == 0:
+            title = match["rule"]["category"]["name"]
+
+        # Set the category
+        if match["type"]["typeName"] == "Hint":
+            category = "hint"
+        elif match["rule"]["issueType"] == "style":
+            category = "hint"
+        elif match["type"]["typeName"] == "Other":
+            category = "warning"
+        elif match["rule"]["issueType"] == "inconsistency":
+            category = "warning"
+        else:
+            category = "error"
+
+        # The suggestions are extracted from the replacements when needed
+        matches.append(Match(
+            title, match["message"], category,
+            match["offset"], match["length"],
+            replacements=match["replacements"]
+        ))
+
+    return matches
+
+
+class CheckCache(object):
+    """On disk cache of the annotations found for paragraphs.
+
+    Entries are keyed by the language, the version of LanguageTool and the
+    hash of the normalized paragraph. The least recently used entries are
+    evicted, many at once, when there are more than max_entries of them.
+
+    This runs on the main loop, so lookups only read: the times the entries
+    were used are written along with the next results stored.
+    """
+
+    def __init__(self, path: Path, max_entries: int = CACHE_MAX_ENTRIES):
+        self._max_entries = max_entries
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(path))
+
+        # Losing the last results in a crash is fine for a cache, not
+        # syncing every transaction is what matters
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                annotations TEXT NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_last_used ON results(last_used);
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+
+        # Until the server tells us, assume it is the one seen last time
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE name = 'server_version'"
+        ).fetchone()
+        self._server_version = row[0] if row is not None else ""
+
+        # An upper bound of the number of entries, counted again only when
+        # it goes over the maximum
+        self._count = self._connection.execute(
+            "SELECT COUNT(*) FROM results"
+        ).fetchone()[0]
+
+        # When the entries looked up were used, to write later
+        self._used = {}
+
+    @property
+    def server_version(self) -> str:
+        return self._server_version
+
+    @server_version.setter
+    def server_version(self, value: str):
+        if value == self._server_version:
+            return
+        self._server_version = value
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('server_version', ?)",
+                (value,)
+            )
+
+    def _key(self, language: str, paragraph: str) -> str:
+        normalized = paragraph.translate(SPACES)
+        payload = f"{language}\0{self._server_version}\0{normalized}"
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get_many(self, language: str, paragraphs) -> dict:
+        """Return the annotations known for some of the paragraphs."""
+        keys = {self._key(language, p): p for p in paragraphs}
+        found = {}
+        now = time.time()
+        pending = list(keys)
+        while len(pending) > 0:
+            batch = pending[:CACHE_LOOKUP_BATCH]
+            pending = pending[CACHE_LOOKUP_BATCH:]
+            rows = self._connection.execute(
+                "SELECT key, annotations FROM results WHERE key IN "
+                f"({', '.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            for key, annotations in rows:
+                found[keys[key]] = [
+                    _match_from_dict(data) for data in json.loads(annotations)
+                ]
+                self._used[key] = now
+        return found
+
+    def put_many(self, language: str, results: dict):
+        """Store the annotations found for paragraphs."""
+        now = time.time()
+        rows = [
+            (
+                self._key(language, paragraph),
+                json.dumps([_match_to_dict(a) for a in annotations]),
+                now
+            )
+            for paragraph, annotations in results.items()
+        ]
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)", rows
+            )
+            self._write_used()
+
+            # Replaced entries are counted too, the bound is only checked
+            # against the real count when it looks too high
+            self._count += len(rows)
+            if self._count > self._max_entries:
+                self._evict()
+
+    def _write_used(self):
+        """Write when the entries looked up since the last time were used."""
+        if len(self._used) == 0:
+            return
+        self._connection.executemany(
+            "UPDATE results SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in self._used.items()]
+        )
+        self._used = {}
+
+    def _evict(self):
+        """Evict the entries not used for the longest time, leaving room
+        for many more before doing it again."""
+        count = self._connection.execute(
+            "SELECT COUNT(*) FROM results"
+        ).fetchone()[0]
+        if count > self._max_entries:
+            keep = int(self._max_entries * CACHE_EVICTION_RATIO)
+            self._connection.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results "
+                "ORDER BY last_used ASC LIMIT ?)",
+                (count - keep,)
+            )
+            count = keep
+        self._count = count
+
+    def close(self):
+        with self._connection:
+            self._write_used()
+        self._connection.close()
+
+
+def _match_to_dict(match: Match) -> dict:
+    return {
+        "title": match.title,
+        "message": match.message,
+        "category": match.category,
+        "offset": match.offset,
+        "length": match.length,
+        "suggestions": list(match.suggestions),
+    }
+
+
+def _match_from_dict(data: dict) -> Match:
+    return Match(
+        data["title"], data["message"], data["category"],
+        data["offset"], data["length"],
+        suggestions=data["suggestions"]
+    )
+
+
+class ParagraphChecker(object):
+    """Only send to LanguageTool the paragraphs which changed.
+
+    The editor gives the paragraphs of the lines edited since the last
+    check. The annotations found for every paragraph are kept, relative to
+    the start of the paragraph, and placed back at its offset.
+    """
+
+    def __init__(self, language_tool, language: str):
+        self._language_tool = language_tool
+        self._language = language
+
+        # The annotations of the paragraph texts checked recently, from the
+        # least to the most recently used
+        self._results = {}
+
+    def reset(self):
+        """Forget about all the paragraphs checked so far."""
+        self._results = {}
+
+    def close(self):
+        """Forget about everything, including the checks still running."""
+        self.reset()
+        self._language_tool.forget(self)
+
+    def check(self, paragraphs: list, callback) -> list:
+        """
+        Check paragraphs, given as (offset, text) pairs, and call back with
+        those checked and their annotations.
+
+        Return the paragraphs which could not be checked because the server
+        is not there, to give them again later.
+        """
+        # Those we know about are used again
+        self._remember({
+            paragraph: self._results[paragraph]
+            for _offset, paragraph in paragraphs
+            if paragraph in self._results
+        })
+
+        # Put together all the paragraphs we don't know about yet, once
+        # each and in the order they appear
+        changed = list(dict.fromkeys(
+            paragraph for _offset, paragraph in paragraphs
+            if paragraph not in self._results
+        ))
+
+        # Some of them may have been checked in a previous session
+        if len(changed) > 0:
+            cache = self._language_tool.cache
+            self._remember(cache.get_many(self._language, changed))
+            changed = [p for p in changed if p not in self._results]
+
+        # Without a server, we can only use what we already know
+        if len(changed) == 0 or not self._language_tool.server_is_alive:
+            known = [p for p in paragraphs if p[1] in self._results]
+            unknown = [p for p in paragraphs if p[1] not in self._results]
+            callback(known, self._place(known))
+            self._trim()
+            return unknown
+
+        logger.debug(f"Checking {len(changed)}/{len(paragraphs)} paragraphs")
+        self._language_tool.check(
+            "\n\n".join(changed),
+            self._language,
+            lambda annotations: self._on_checked(
+                paragraphs, changed, annotations, callback
+            ),
+            document=self
+        )
+        return []
+
+    def _on_checked(self, paragraphs, changed, annotations, callback):
+        # Offsets of the paragraphs in the text sent for checking
+        starts = []
+        results = {}
+        offset = 0
+        for paragraph in changed:
+            starts.append(offset)
+            results[paragraph] = []
+            offset += len(paragraph) + 2
+
+        # Store the annotations relative to the start of their paragraph
+        for annotation in annotations:
+            index = bisect_right(starts, annotation.offset) - 1
+            relative = annotation.offset - starts[index]
+            annotation.offset = relative
+            results[changed[index]].append(annotation)
+
+        # Keep them for the next time these paragraphs are checked
+        self._remember(results)
+        self._language_tool.cache.put_many(self._language, results)
+
+        callback(paragraphs, self._place(paragraphs))
+        self._trim()
+
+    def _remember(self, results: dict):
+        """Keep the results of paragraphs, as the most recently used."""
+        for paragraph, found in results.items():
+            self._results.pop(paragraph, None)
+            self._results[paragraph] = found
+
+    def _trim(self):
+        """Forget about the results used the least recently, once they
+        have been placed."""
+        while len(self._results) > CHECKER_MAX_RESULTS:
+            del self._results[next(iter(self._results))]
+
+    def _place(self, paragraphs) -> list:
+        """Return the annotations of paragraphs, placed at their offset."""
+        annotations = []
+        for offset, paragraph in paragraphs:
+            for annotation in self._results.get(paragraph, []):
+                annotations.append(annotation.copy_at(offset + annotation.offset))
+        return annotations
+
+
 class LanguageTool(GObject.Object):
 
     # This is True when we could connect to Language Tool, False otherwise
@@ -41,6 +382,18 @@ class LanguageTool(GObject.Object):
 
         self._proc_language_tool = None
 
+        # The latest generation of check asked for every document, the checks
+        # waiting to be sent and the cancellables of the ones sent
+        self._generations = {}
+        self._pending = []
+        self._in_flight = {}
+        self._running = 0
+
+        # The results of previous checks
+        self.cache = CheckCache(
+            Path(GLib.get_user_cache_dir()) / "scriptorium" / "language_tool.db"
+        )
+
         GLib.timeout_add_seconds(SEND_PING_TIMEOUT_SECONDS, self.send_ping)
 
     def send_ping(self):
@@ -67,6 +420,7 @@ class LanguageTool(GObject.Object):
             GLib.timeout_add_seconds(SEND_PING_TIMEOUT_SECONDS, self.send_ping)
 
     def shutdown(self):
+        self.cache.close()
         if self._proc_language_tool:
             self._proc_language_tool.force_exit()
 
@@ -92,10 +446,25 @@ class LanguageTool(GObject.Object):
             Gio.SubprocessFlags.INHERIT_FDS | Gio.SubprocessFlags.STDOUT_PIPE,
         )
 
-    def check(self, text: str, language: str, callback):
+    def check(self, text: str, language: str, callback, document=None):
+        """Check a text and call back with the annotations found.
+
+        A new check for the same document supersedes the previous ones: they
+        are cancelled if running, dropped if queued, and their results are
+        ignored if they arrive anyway.
+        """
         if not self.server_is_alive:
             return None
 
+        # This check is now the latest one for the document
+        generation = self._generations.get(document, 0) + 1
+        self._generations[document] = generation
+
+        # Drop what was queued and cancel what was sent for that document
+        self._pending = [p for p in self._pending if p[0] != document]
+        if document in self._in_flight:
+            self._in_flight.pop(document).cancel()
+
         encoded = Soup.form_encode_hash({
             "text": text,
             "language": language,
@@ -107,56 +476,66 @@ class LanguageTool(GObject.Object):
             encoded_form=encoded
         )
 
-        self._session.send_and_read_async(
-            msg=message,
-            cancellable=None,
-            io_priority=GObject.PRIORITY_LOW,
-            callback=self._process_check_result,
-            user_data=callback
-        )
-
-    def _process_check_result(self, session, result, callback):
+        self._pending.append((document, generation, message, callback))
+        self._send_pending()
+
+    def forget(self, document):
+        """Drop and cancel the checks of a document which is not used
+        anymore, their results will be ignored."""
+        self._generations.pop(document, None)
+        self._pending = [p for p in self._pending if p[0] != document]
+        if document in self._in_flight:
+            self._in_flight.pop(document).cancel()
+
+    def _send_pending(self):
+        """Send the queued checks, without exceeding the concurrency limit."""
+        while len(self._pending) > 0 and self._running < MAX_RUNNING_CHECKS:
+            document, generation, message, callback = self._pending.pop(0)
+
+            cancellable = Gio.Cancellable()
+            self._in_flight[document] = cancellable
+            self._running += 1
+
+            self._session.send_and_read_async(
+                msg=message,
+                cancellable=cancellable,
+                io_priority=GObject.PRIORITY_LOW,
+                callback=self._process_check_result,
+                user_data=(document, generation, cancellable, callback)
+            )
+
+    def _process_check_result(self, session, result, user_data):
         """Handle a response to a check request."""
+        document, generation, cancellable, callback = user_data
+
+        # That request is not running anymore, let the next ones go
+        self._running -= 1
+        if self._in_flight.get(document) == cancellable:
+            del self._in_flight[document]
+        self._send_pending()
 
         # Decode the response
-        raw_data = session.send_and_read_finish(result)
+        try:
+            raw_data = session.send_and_read_finish(result)
+        except GLib.GError as e:
+            if not cancellable.is_cancelled():
+                logger.warning(f"Check failed: {e.message}")
+            return
+
+        # Forget about it if a more recent check was asked for
+        if generation != self._generations.get(document):
+            logger.debug("Dropping the results of a superseded check")
+            return
+
         results = json.loads(raw_data.get_data().decode())
 
-        # Prepare a list of annotations
-        annotations = []
-        for match in results['matches']:
-            annotation = Annotation()
-
-            # Set the message
-            annotation.title = match["shortMessage"]
-            if len(match["shortMessage"]) == 0:
-                annotation.title = match["rule"]["category"]["name"]
-            annotation.message = match["message"]
-
-            # Set the boundaries
-            annotation.offset = match["offset"]
-            annotation.length = match["length"]
-
-            # Set the category
-            if match["type"]["typeName"] == "Hint":
-                annotation.category = "hint"
-            elif match["rule"]["issueType"] == "style":
-                annotation.category = "hint"
-            elif match["type"]["typeName"] == "Other":
-                annotation.category = "warning"
-            elif match["rule"]["issueType"] == "inconsistency":
-                annotation.category = "warning"
-            else:
-                annotation.category = "error"
-
-            # Add the suggestions
-            for replacement in match["replacements"]:
-                annotation.suggestions.append(replacement["value"])
-
-            # Append the annotation
-            annotations.append(annotation)
+        # Results are cached per version of the server
+        version = results.get("software", {}).get("version")
+        if version is not None:
+            self.cache.server_version = version
+
+        # Turn them into annotations
+        annotations = parse_check_result(results)
 
         # Call back with the annotations
         callback(annotations)
-
-
@@ -17,8 +17,8 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 import sys
-from .application import ScriptoriumApplication
 import logging
+from .cli import COMMANDS, run
 
 logging.basicConfig(
     level=logging.INFO,
@@ -29,6 +29,13 @@ logger = logging.getLogger(__name__)
 
 def main(version):
     """The application's entry point."""
+    # Run without any window if we are asked for one of the CLI commands
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return run(sys.argv[1:])
+
+    # Only load the UI now, the CLI does not need a display
+    from .application import ScriptoriumApplication
+
     logger.info(f"Starting Scriptorium {version}")
     app = ScriptoriumApplication()
     return app.run(sys.argv)
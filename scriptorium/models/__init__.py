@@ -25,11 +25,13 @@ from .scene import Scene
 from .commit_message import CommitMessage
 from .entity import Entity
 from .project import Project
-from .annotation import Annotation
+from .annotation import Annotation, AnnotationIndex, AnnotationList, Match
 from .resource import Resource
 from .image import Image
+from .journal import RecoveryJournal
 
 __all__ = [
     'Library', 'Manuscript', 'Chapter', 'Scene', 'CommitMessage',
-    'Entity', 'Project', 'Annotation', 'Resource', 'Image'
+    'Entity', 'Project', 'Annotation', 'AnnotationIndex', 'AnnotationList',
+    'Match', 'Resource', 'Image', 'RecoveryJournal'
 ]
@@ -19,25 +19,260 @@
 # TODO: Turn those into a Resource managed via the project to handle
 # sharing annotation across authors
 
-from gi.repository import GObject, Gtk
+from gi.repository import GObject, Gio
+from bisect import bisect_left, bisect_right
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class Match(object):
+    """Compact storage for a section of a text marked with some text.
+
+    The suggestions are only extracted from the raw replacements sent by
+    LanguageTool the first time they are needed.
+    """
+    __slots__ = (
+        "title", "message", "category", "offset", "length",
+        "_replacements", "_suggestions"
+    )
+
+    def __init__(self, title: str, message: str, category: str,
+                 offset: int, length: int, replacements=None,
+                 suggestions=None):
+        self.title = title
+        self.message = message
+        self.category = category
+        self.offset = offset
+        self.length = length
+        self._replacements = replacements
+        self._suggestions = suggestions
+
+    @property
+    def suggestions(self) -> list:
+        if self._suggestions is None:
+            self._suggestions = [r["value"] for r in self._replacements or []]
+            self._replacements = None
+        return self._suggestions
+
+    def copy_at(self, offset: int):
+        """Return a copy of the match placed at another offset."""
+        return Match(
+            self.title, self.message, self.category, offset, self.length,
+            self._replacements, self._suggestions
+        )
+
+
 class Annotation(GObject.Object):
-    """An annotation is a section of a text marked with some text."""
+    """An annotation is a section of a text marked with some text.
+
+    This wraps a Match for the widgets which need a GObject, the properties
+    follow the match as its offset changes.
+    """
     __gtype_name__ = "Annotation"
 
-    title = GObject.Property(type=str)
-    message = GObject.Property(type=str)
-    category = GObject.Property(type=str)
-    offset = GObject.Property(type=int)
-    length = GObject.Property(type=int)
-    suggestions = GObject.Property(type=Gtk.StringList)
+    def __init__(self, match: Match):
+        """Create a new instance of Annotation."""
+        super().__init__()
+        self._match = match
+
+    @property
+    def match(self) -> Match:
+        return self._match
+
+    @GObject.Property(type=str)
+    def title(self) -> str:
+        return self._match.title
+
+    @GObject.Property(type=str)
+    def message(self) -> str:
+        return self._match.message
+
+    @GObject.Property(type=str)
+    def category(self) -> str:
+        return self._match.category
+
+    @GObject.Property(type=int)
+    def offset(self) -> int:
+        return self._match.offset
+
+    @GObject.Property(type=int)
+    def length(self) -> int:
+        return self._match.length
+
+    @GObject.Property(type=GObject.TYPE_STRV)
+    def suggestions(self) -> list:
+        return self._match.suggestions
+
+
+class AnnotationList(GObject.Object, Gio.ListModel):
+    """A list model of matches, wrapped into annotations when displayed."""
+    __gtype_name__ = "AnnotationList"
 
     def __init__(self):
-        """Create a new instance of Chapter."""
         super().__init__()
-        self.suggestions = Gtk.StringList()
+        self._matches = []
+        self._wrappers = {}
+
+    def __iter__(self):
+        return iter(self._matches)
+
+    def do_get_item_type(self):
+        return Annotation.__gtype__
+
+    def do_get_n_items(self) -> int:
+        return len(self._matches)
+
+    def do_get_item(self, position: int):
+        if position >= len(self._matches):
+            return None
+
+        # Only create a wrapper for the matches which are looked at
+        match = self._matches[position]
+        wrapper = self._wrappers.get(id(match))
+        if wrapper is None:
+            wrapper = Annotation(match)
+            self._wrappers[id(match)] = wrapper
+        return wrapper
+
+    def splice(self, position: int, n_removals: int, matches: list):
+        """Replace some matches of the list with others."""
+        for match in self._matches[position:position + n_removals]:
+            self._wrappers.pop(id(match), None)
+        self._matches[position:position + n_removals] = matches
+        self.items_changed(position, n_removals, len(matches))
+
+    def remove_all(self):
+        self.splice(0, len(self._matches), [])
+
+
+class AnnotationIndex(object):
+    """Annotations of a text sorted by offset, to find them quickly.
+
+    The offsets of the annotations are kept in sync with the edits of the
+    text, those touched by an edit are dropped until the next check.
+    """
+
+    def __init__(self):
+        self._annotations = []
+        self._starts = []
+
+        # The longest annotation tells how far back to look for a match
+        self._max_length = 0
+
+    def __iter__(self):
+        return iter(self._annotations)
+
+    def __len__(self):
+        return len(self._annotations)
+
+    @staticmethod
+    def _key(annotation):
+        return (
+            annotation.offset, annotation.length,
+            annotation.category, annotation.message
+        )
+
+    def _set(self, annotations):
+        self._annotations = sorted(annotations, key=lambda a: a.offset)
+        self._starts = [a.offset for a in self._annotations]
+        self._max_length = max([a.length for a in annotations], default=0)
+
+    def clear(self):
+        self._set([])
+
+    def update(self, annotations):
+        """Replace the annotations and return the (added, removed) ones.
+
+        Annotations identical to existing ones are not reported, and the
+        existing instances are kept.
+        """
+        current = {self._key(a): a for a in self._annotations}
+        new = {self._key(a): a for a in annotations}
+
+        added = [a for key, a in new.items() if key not in current]
+        removed = [a for key, a in current.items() if key not in new]
+        kept = [a for key, a in current.items() if key in new]
+
+        self._set(kept + added)
+        return added, removed
+
+    def update_ranges(self, ranges, annotations):
+        """Replace the annotations starting in some (start, end) ranges of
+        the text and return the (added, removed) ones, as update does."""
+        ranges = sorted(ranges)
+        range_starts = [start for start, _end in ranges]
+
+        def in_ranges(annotation):
+            index = bisect_right(range_starts, annotation.offset) - 1
+            return index >= 0 and annotation.offset < ranges[index][1]
+
+        outside = [a for a in self._annotations if not in_ranges(a)]
+        current = {
+            self._key(a): a for a in self._annotations if in_ranges(a)
+        }
+        new = {self._key(a): a for a in annotations if in_ranges(a)}
+
+        added = [a for key, a in new.items() if key not in current]
+        removed = [a for key, a in current.items() if key not in new]
+        kept = [a for key, a in current.items() if key in new]
+
+        self._set(outside + kept + added)
+        return added, removed
+
+    def at(self, offset: int):
+        """Return the annotation found at an offset, if any."""
+        index = bisect_right(self._starts, offset) - 1
+        while index >= 0 and self._starts[index] > offset - self._max_length:
+            annotation = self._annotations[index]
+            if offset < annotation.offset + annotation.length:
+                return annotation
+            index -= 1
+        return None
+
+    def overlapping(self, start: int, end: int) -> list:
+        """Return the annotations overlapping a range of the text."""
+        first = bisect_left(self._starts, start - self._max_length)
+        last = bisect_left(self._starts, end)
+        return [
+            a for a in self._annotations[first:last]
+            if a.offset + a.length > start
+        ]
+
+    def on_inserted(self, offset: int, length: int) -> list:
+        """Shift the annotations after some text got inserted.
+
+        Return the annotations dropped, set to cover their edited range.
+        """
+        return self._on_edit(offset, offset, length)
+
+    def on_deleted(self, start: int, end: int) -> list:
+        """Shift the annotations after some text got deleted.
+
+        Return the annotations dropped, set to cover their edited range.
+        """
+        return self._on_edit(start, end, start - end)
+
+    def _on_edit(self, start: int, end: int, delta: int) -> list:
+        # Drop what the edit touched, then shift what comes after it
+        kept = []
+        dropped = []
+        for annotation in self._annotations:
+            if annotation.offset + annotation.length <= start:
+                kept.append(annotation)
+            elif annotation.offset >= end:
+                annotation.offset += delta
+                kept.append(annotation)
+            else:
+                annotation_end = annotation.offset + annotation.length
+                annotation.offset = min(annotation.offset, start)
+                annotation.length = (
+                    max(annotation_end, end) + delta - annotation.offset
+                )
+                dropped.append(annotation)
+
+        # The order is unchanged so there is no need to sort again
+        self._annotations = kept
+        self._starts = [a.offset for a in kept]
 
+        return dropped
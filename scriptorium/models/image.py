@@ -1,11 +1,15 @@
 import logging
-from gi.repository import GObject, Gio, Gdk
+from gi.repository import GObject
 from .resource import Resource
 from pathlib import Path
-import shutil
+from scriptorium.utils.storage import atomic_write_bytes
+import hashlib
 
 logger = logging.getLogger(__name__)
 
+# Extensions written differently for the same format of image
+EXTENSION_ALIASES = {".jpeg": ".jpg", ".jpe": ".jpg", ".tif": ".tiff"}
+
 
 class Image(Resource):
 
@@ -22,8 +26,6 @@ class Image(Resource):
         if not self.base_directory.exists():
             self.base_directory.mkdir()
 
-        self._texture = None
-
     @property
     def data_files(self):
         """Return the file path for the image if it has been set."""
@@ -36,41 +38,90 @@ class Image(Resource):
     def path(self):
         return self.data_files[0] if len(self.data_files) > 0 else None
 
-    @property
-    def width(self):
-        return self.texture.get_width()
-
-    @property
-    def height(self):
-        return self.texture.get_height()
-
-    def set_content_from_path(self, file_path: Path):
-        """Set the content of the image from the file path indicated."""
-
-        # Define the target file name
-        file_extensions = ''.join(file_path.suffixes)
-        self.file_name = self.identifier + file_extensions
-
-        # Copy the content of the file
+    def set_content_from_path(self, file_path: Path, max_size: int = 0):
+        """
+        Set the content of the image from the file path indicated.
+
+        The content is stored under its hash, so importing the same file
+        twice stores it once. Images wider or taller than max_size, if not
+        0, are scaled down first.
+        """
+        content = None
+        file_extension = _extension(file_path)
+        if max_size > 0:
+            scaled = _scale_down(file_path, max_size)
+            if scaled is not None:
+                content, file_extension = scaled
+        if content is None:
+            content = file_path.read_bytes()
+
+        # Point at the content, the previous one may not be needed anymore
+        previous_path = self.path
+        self.file_name = hashlib.sha256(content).hexdigest() + file_extension
         target_path = self.base_directory / Path(self.file_name)
-        shutil.copyfile(file_path, target_path)
-
-        # Commit the change in content
-        repo = self.project.repo
-        repo.index.add(target_path)
-        repo.index.commit(f'Set image content for "{self.identifier}"')
 
-    @property
-    def texture(self) -> Gdk.Texture:
-        """A texture associated with the image."""
-        # If texture does not exist load the image
-        if self._texture is None:
-            if len(self.data_files) > 0:
-                self._texture = Gdk.Texture.new_from_file(
-                    Gio.File.new_for_path(str(self.data_files[0]).encode())
-                )
-
-        # Return the texture
-        return self._texture
+        removed = None
+        if previous_path is not None and previous_path != target_path:
+            if not self.project.is_data_file_used(previous_path, self):
+                previous_path.unlink(missing_ok=True)
+                removed = previous_path
 
+        # Copy the content of the file, unless it is already there
+        added = None
+        if target_path.exists():
+            logger.info(f"{self.file_name} is already in the project")
+        else:
+            atomic_write_bytes(target_path, content)
+            added = target_path
 
+        # Commit the change in content, in the background
+        repo = self.project.repo
+        message = f'Set image content for "{self.identifier}"'
+
+        def commit():
+            if removed is not None:
+                repo.index.remove(removed)
+            if added is not None:
+                repo.index.add(added)
+            repo.index.commit(message)
+
+        self.project.run_in_repository(commit)
+
+
+def _extension(file_path: Path) -> str:
+    """
+    Return the extension of an image file in the form used for the files
+    of the project, so that the same content gets the same file name.
+    """
+    extension = file_path.suffix.lower()
+    return EXTENSION_ALIASES.get(extension, extension)
+
+
+def _scale_down(file_path: Path, max_size: int):
+    """
+    Return the content of the image scaled down to fit in a square of
+    max_size pixels and its extension, or None if it already fits.
+    """
+    from gi.repository import GdkPixbuf, GLib
+
+    image_format, width, height = GdkPixbuf.Pixbuf.get_file_info(
+        str(file_path)
+    )
+    if image_format is None or (width <= max_size and height <= max_size):
+        return None
+
+    try:
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
+            str(file_path), max_size, max_size, True
+        )
+        pixbuf = pixbuf.apply_embedded_orientation()
+
+        # Keep photos as JPEG, everything else becomes a PNG
+        if image_format.get_name() == "jpeg":
+            _ok, content = pixbuf.save_to_bufferv("jpeg", ["quality"], ["90"])
+            return content, ".jpg"
+        _ok, content = pixbuf.save_to_bufferv("png", [], [])
+        return content, ".png"
+    except GLib.GError as e:
+        logger.warning(f"Could not scale {file_path} down: {e}")
+        return None
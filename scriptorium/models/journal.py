@@ -0,0 +1,166 @@
+# models/journal.py
+#
+# Copyright 2025 Christophe Gueret
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Journal of the unsaved content of scenes, to recover it after a crash."""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from gi.repository import GLib
+from scriptorium.utils.storage import atomic_write_text
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for more snapshots before writing them all at once
+JOURNAL_FLUSH_DELAY = 2
+
+# Size of the journal file above which it is rewritten with only what
+# can still be recovered
+JOURNAL_MAX_SIZE = 4 * 1024 * 1024
+
+
+class RecoveryJournal(object):
+    """
+    Append-only journal of snapshots of the scenes being edited.
+
+    Every line of the file is a JSON record, either a snapshot of the
+    formatted text of a scene or a marker saying it was saved since. The
+    last record of each scene tells if it has something to recover.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+
+        # Records waiting to be written, one per scene
+        self._pending = {}
+        self._flush_source_id = None
+
+        # The last record written for each scene which has not been saved
+        self._unsaved = {}
+
+        # A single thread writes the file, in the order of the flushes
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="journal"
+        )
+
+    def record(self, identifier: str, text: str, segments: list):
+        """Keep a snapshot of a scene, as returned by get_formatted_text."""
+        segments = [(end, sorted(tags)) for end, tags in segments]
+        self._add({"scene": identifier, "text": text, "segments": segments})
+
+    def mark_saved(self, identifier: str):
+        """Record that the scene has been saved, nothing to recover."""
+        self._add({"scene": identifier, "saved": True})
+
+    def _add(self, record: dict):
+        # Only the most recent record of a scene is worth writing
+        self._pending.pop(record["scene"], None)
+        self._pending[record["scene"]] = record
+
+        if self._flush_source_id is None:
+            self._flush_source_id = GLib.timeout_add_seconds(
+                JOURNAL_FLUSH_DELAY, self.flush
+            )
+
+    def flush(self):
+        """Write all the pending records with a single sync."""
+        if self._flush_source_id is not None:
+            GLib.source_remove(self._flush_source_id)
+            self._flush_source_id = None
+        if len(self._pending) == 0:
+            return False
+
+        records = list(self._pending.values())
+        for identifier, record in self._pending.items():
+            if record.get("saved", False):
+                self._unsaved.pop(identifier, None)
+            else:
+                self._unsaved[identifier] = record
+        self._pending = {}
+
+        # The records are not changed once added, they can be serialized
+        # in the thread
+        future = self._executor.submit(
+            self._write, records, list(self._unsaved.values())
+        )
+        future.add_done_callback(self._log_error)
+
+        # Don't repeat that callback
+        return False
+
+    def _write(self, records: list, unsaved: list):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Keep the file small by rewriting it when it grows too much
+        if self._path.exists() and self._path.stat().st_size > JOURNAL_MAX_SIZE:
+            logger.info(f"Compacting {self._path}")
+            atomic_write_text(
+                self._path,
+                "".join(json.dumps(record) + "\n" for record in unsaved)
+            )
+            return
+
+        lines = [json.dumps(record) + "\n" for record in records]
+
+        # A line cut short by a crash must not swallow the next one
+        if self._path.exists() and self._path.stat().st_size > 0:
+            with open(self._path, "rb") as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read(1) != b"\n":
+                    lines.insert(0, "\n")
+
+        with open(self._path, "a") as output:
+            output.writelines(lines)
+            output.flush()
+            os.fsync(output.fileno())
+
+    def _log_error(self, future):
+        if future.exception() is not None:
+            logger.error(f"Could not write {self._path}: {future.exception()}")
+
+    def recoverable(self) -> dict:
+        """Return the formatted text of the scenes not saved, by scene."""
+        snapshots = {}
+        if not self._path.exists():
+            return snapshots
+
+        for line in self._path.read_text().splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may have been cut short by the crash
+                logger.warning(f"Ignoring a broken line in {self._path}")
+                continue
+
+            if record.get("saved", False):
+                snapshots.pop(record["scene"], None)
+            else:
+                segments = [
+                    (end, set(tags)) for end, tags in record["segments"]
+                ]
+                snapshots[record["scene"]] = (record["text"], segments)
+
+        return snapshots
+
+    def clear(self):
+        """Forget about everything, once it has been recovered or not."""
+        self._pending = {}
+        self._unsaved = {}
+        self._executor.submit(self._path.unlink, missing_ok=True)
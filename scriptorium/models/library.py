@@ -19,8 +19,12 @@
 """A Library is a collection of manuscripts."""
 
 from pathlib import Path
-from gi.repository import GObject, Gio
+from gi.repository import GObject, Gio, GLib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import logging
+import multiprocessing
+import threading
 import uuid
 import shutil
 
@@ -29,6 +33,23 @@ from .manuscript import Manuscript
 
 logger = logging.getLogger(__name__)
 
+# Outcome of the migration of one project in a batch
+MigrationResult = namedtuple(
+    "MigrationResult", ["project", "worked", "snapshot", "error"]
+)
+
+
+def _migrate_project(project_path: str):
+    """Snapshot and migrate the project at a path, in a worker process."""
+    try:
+        project = Project(project_path)
+        snapshot = project.create_snapshot()
+    except Exception as e:
+        return False, None, f"Could not create a snapshot: {e}"
+
+    worked = project.migrate()
+    return worked, snapshot, project.migration_error
+
 
 class Library(GObject.Object):
     """The library is the collection of projects."""
@@ -94,6 +115,54 @@ class Library(GObject.Object):
             path = self.base_directory / Path(project.identifier)
             shutil.rmtree(path)
 
+    @property
+    def projects_to_migrate(self):
+        """The projects that need a migration before being opened."""
+        return [p for p in self.projects if not p.can_be_opened]
+
+    def migrate_projects(self, projects, on_progress, on_done):
+        """Migrate a batch of projects in parallel worker processes.
+
+        Every project is snapshotted before being migrated. The callbacks are
+        called from the main loop: on_progress(result, done, total) after
+        each project and on_done(results) once all of them are processed.
+        """
+        total = len(projects)
+        logger.info(f"Migrating {total} projects")
+
+        def run_batch():
+            results = []
+
+            # Spawn fresh interpreters rather than forking the UI process
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(mp_context=context) as executor:
+                futures = {
+                    executor.submit(_migrate_project, str(p.base_directory)): p
+                    for p in projects
+                }
+                for future in as_completed(futures):
+                    project = futures[future]
+                    try:
+                        worked, snapshot, error = future.result()
+                    except Exception as e:
+                        worked, snapshot, error = False, None, str(e)
+                    result = MigrationResult(project, worked, snapshot, error)
+                    results.append(result)
+                    GLib.idle_add(
+                        self._on_project_migrated, result, len(results),
+                        total, on_progress
+                    )
+
+            GLib.idle_add(on_done, results)
+
+        threading.Thread(target=run_batch, daemon=True).start()
+
+    def _on_project_migrated(self, result, done, total, on_progress):
+        """Refresh a project migrated in a worker and report progress."""
+        result.project.reload()
+        on_progress(result, done, total)
+        return False
+
     def get_project(self, identifier):
         """Return a project based on a requested identifier."""
 
@@ -71,4 +71,24 @@ class Manuscript(Resource):
         self.content.remove(source_position)
         self.content.insert(target_position, source_chapter)
 
+    def iter_scenes(self):
+        """Iterate over all the scenes of the manuscript in reading order."""
+        pending = list(self.content)
+        while len(pending) > 0:
+            resource = pending.pop(0)
+            if isinstance(resource, Chapter):
+                pending[0:0] = list(resource.content)
+            elif isinstance(resource, Scene):
+                yield resource
+
+    def get_neighbours(self, scene):
+        """Return the scenes before and after a scene in reading order."""
+        previous = None
+        scenes = self.iter_scenes()
+        for current in scenes:
+            if current is scene:
+                return previous, next(scenes, None)
+            previous = current
+        return None, None
+
 
@@ -18,7 +18,8 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
-from gi.repository import GObject, Gio, Gtk
+from concurrent.futures import ThreadPoolExecutor
+from gi.repository import GObject, Gio, GLib
 import git
 import yaml
 from pathlib import Path
@@ -30,6 +31,8 @@ from .chapter import Chapter
 from .scene import Scene
 from .entity import Entity
 from .manuscript import Manuscript
+from .journal import RecoveryJournal
+from scriptorium.utils.storage import atomic_write_text
 
 
 logger = logging.getLogger(__name__)
@@ -44,6 +47,14 @@ CLASSES = {
 
 PROJECT_DESCRIPTION_VERSION = 1
 
+# Prefix of the git tags used to snapshot a project before a migration
+SNAPSHOT_TAG_PREFIX = "pre-migration-v"
+
+# A single thread does all the operations on the repositories, one after
+# the other, so that they never use an index concurrently and the main loop
+# never waits for them
+_save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="save")
+
 
 class Project(GObject.Object):
     __gtype_name__ = "Project"
@@ -63,6 +74,12 @@ class Project(GObject.Object):
     # The content of the YAML file descriptior
     _yaml_data = None
 
+    # The reason why the last migration failed, if it did
+    migration_error = None
+
+    # The journal of unsaved scenes, created when first needed
+    _journal = None
+
     def __init__(self, project_path):
         """Create a resource."""
         super().__init__()
@@ -73,6 +90,11 @@ class Project(GObject.Object):
         # All the resources
         self._resources = Gio.ListStore(item_type=Resource)
 
+        # The same resources, grouped per type for the views
+        self._scenes = Gio.ListStore(item_type=Scene)
+        self._entities = Gio.ListStore(item_type=Entity)
+        self._images = Gio.ListStore(item_type=Image)
+
         # TODO Load the YAML data and extract the project format version
         # Add a bool function to check if up to date
         # Add a function to trigger a migration
@@ -100,7 +122,9 @@ class Project(GObject.Object):
 
             # Do a first commit
             self._save_yaml()
-            self.repo.index.commit("Created project")
+            self.run_in_repository(
+                self.repo.index.commit, "Created project"
+            ).result()
 
         # See if we can open the project
         self._set_can_be_opened()
@@ -112,8 +136,76 @@ class Project(GObject.Object):
         project_version = self._yaml_data.get("version", 0)
         self.can_be_opened = project_version == PROJECT_DESCRIPTION_VERSION
 
+    @property
+    def snapshot_tag(self) -> str:
+        """Name of the tag used to snapshot the project before migrating."""
+        return f"{SNAPSHOT_TAG_PREFIX}{self._yaml_data.get('version', 0)}"
+
+    def run_in_repository(self, function, *args):
+        """
+        Run an operation on the repository in the thread doing all of them,
+        after those queued before it. Return its future.
+        """
+        future = _save_executor.submit(function, *args)
+        future.add_done_callback(self._log_repository_error)
+        return future
+
+    def _log_repository_error(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(
+                f"Could not update the repository of {self.identifier}: "
+                f"{future.exception()}"
+            )
+
+    def create_snapshot(self) -> str:
+        """Tag the current state of the project so it can be rolled back."""
+        return self.run_in_repository(self._create_snapshot).result()
+
+    def _create_snapshot(self) -> str:
+        # Make sure the snapshot includes any pending change to the YAML
+        if self.repo.is_dirty(untracked_files=False):
+            self.repo.git.add(update=True)
+            self.repo.index.commit("Snapshot before migration")
+
+        # Tag the current head, replacing any older snapshot for that version
+        tag_name = self.snapshot_tag
+        self.repo.create_tag(
+            tag_name,
+            ref="HEAD",
+            message="State of the project before migration",
+            force=True
+        )
+        logger.info(f"Created snapshot {tag_name} of {self.identifier}")
+
+        return tag_name
+
+    def rollback_migration(self, tag_name: str) -> bool:
+        """Restore the project to the state of a pre-migration snapshot."""
+
+        if tag_name not in self.repo.tags:
+            logger.error(f"No snapshot {tag_name} for {self.identifier}")
+            return False
+
+        # Move back the head, the index and the files to the snapshot
+        commit = self.repo.tags[tag_name].commit
+        self.run_in_repository(
+            lambda: self.repo.head.reset(commit, index=True, working_tree=True)
+        ).result()
+        logger.info(f"Rolled back {self.identifier} to {tag_name}")
+
+        # Refresh what we know about the project
+        self.reload()
+
+        return True
+
+    def reload(self):
+        """Reload the project description, after a change made elsewhere."""
+        self._load_yaml()
+        self._set_can_be_opened()
+
     def migrate(self) -> bool:
         """Migrate the project to the current version of the format."""
+        self.migration_error = None
 
         try:
             # The current version is the one in the file or 0 otherwise
@@ -122,6 +214,7 @@ class Project(GObject.Object):
             # Hello time travelers! Sorry, can't do anything for you
             if current_version > PROJECT_DESCRIPTION_VERSION:
                 logger.error("Can't migrate a project from a future version !")
+                self.migration_error = "Project is from a future version"
                 return False
 
             # Handle migrating from 0 to 1
@@ -142,7 +235,9 @@ class Project(GObject.Object):
             self._save_yaml()
 
             # Commit the migration
-            self.repo.index.commit("Migrated project to new format")
+            self.run_in_repository(
+                self.repo.index.commit, "Migrated project to new format"
+            ).result()
 
             # The project can be opened now
             self.can_be_opened = True
@@ -151,6 +246,7 @@ class Project(GObject.Object):
         except Exception as e:
             # Return false if anything goes wrong
             logger.error(f"Migration issue! {e}")
+            self.migration_error = str(e)
             return False
 
     def _migrate_0_to_1(self):
@@ -180,14 +276,80 @@ class Project(GObject.Object):
         self.title = self._yaml_data.get("title", "")
 
     def _save_yaml(self):
-        """Dump the content of the dict into a YAML file."""
+        """Dump the content of the dict into a YAML file, written in the
+        thread of the repository. Return the future of the write."""
 
         yaml_file = self._base_directory / Path("manuscript.yml")
-        with yaml_file.open(mode="w") as file:
-            yaml.safe_dump(self._yaml_data, file, indent=2, sort_keys=True)
-
-        # Add this edit to the list of changes to be in the next commit
-        self.repo.index.add(yaml_file)
+        content = yaml.safe_dump(self._yaml_data, indent=2, sort_keys=True)
+
+        def save():
+            atomic_write_text(yaml_file, content)
+
+            # Add this edit to the list of changes to be in the next commit
+            self.repo.index.add(yaml_file)
+
+        return self.run_in_repository(save)
+
+    def check_integrity(self) -> list:
+        """Check the consistency of the project and return a list of issues.
+
+        This only relies on the YAML description and the files on disk so
+        that it can be used on projects that can not be opened.
+        """
+        issues = []
+
+        # The format must be the current one
+        version = self._yaml_data.get("version", 0)
+        if version != PROJECT_DESCRIPTION_VERSION:
+            issues.append(f"Project format is version {version}")
+
+        # Every resource must be known and have a unique identifier
+        resources = self._yaml_data.get("resources", [])
+        identifiers = set()
+        for data in resources:
+            identifier = data.get("identifier")
+            if identifier in identifiers:
+                issues.append(f"Duplicated identifier {identifier}")
+            identifiers.add(identifier)
+            if data.get("a") not in CLASSES:
+                issues.append(f"Unknown type {data.get('a')} for {identifier}")
+
+        # We need exactly one manuscript
+        manuscripts = [d for d in resources if d.get("a") == "Manuscript"]
+        if len(manuscripts) != 1:
+            issues.append(f"Found {len(manuscripts)} manuscripts instead of 1")
+
+        # All the references must point to existing resources
+        for data in resources:
+            for key in ["content", "entities", "cover"]:
+                values = data.get(key) or []
+                if isinstance(values, str):
+                    values = [values]
+                for value in values:
+                    if value not in identifiers:
+                        issues.append(
+                            f"{data.get('identifier')} refers to missing {value}"
+                        )
+
+        # The data files must be on disk
+        for data in resources:
+            data_file = None
+            if data.get("a") == "Scene":
+                data_file = Path("scenes") / f"{data.get('identifier')}.html"
+            elif data.get("a") == "Image" and data.get("file_name"):
+                data_file = Path("images") / data.get("file_name")
+            if data_file is not None:
+                if not (self._base_directory / data_file).exists():
+                    issues.append(f"Missing data file {data_file}")
+
+        # There should not be uncommitted changes
+        is_dirty = self.run_in_repository(
+            lambda: self.repo.is_dirty(untracked_files=False)
+        ).result()
+        if is_dirty:
+            issues.append("The project has uncommitted changes")
+
+        return issues
 
     @property
     def base_directory(self) -> Path:
@@ -207,47 +369,81 @@ class Project(GObject.Object):
     @GObject.Property(type=Gio.ListStore)
     def scenes(self):
         """The scenes of the manuscript."""
-        model = Gtk.FilterListModel(
-            model=self._resources,
-            filter=Gtk.CustomFilter.new(lambda x: isinstance(x, Scene))
-        )
-        return model
+        return self._scenes
 
     @GObject.Property(type=Gio.ListStore)
     def entities(self):
-        """The scenes of the manuscript."""
-        model = Gtk.FilterListModel(
-            model=self._resources,
-            filter=Gtk.CustomFilter.new(lambda x: isinstance(x, Entity))
-        )
-        return model
+        """The entities of the manuscript."""
+        return self._entities
 
     @GObject.Property(type=Gio.ListStore)
     def images(self):
         """The instances of Image in the manuscript."""
-        model = Gtk.FilterListModel(
-            model=self._resources,
-            filter=Gtk.CustomFilter.new(lambda x: isinstance(x, Image))
-        )
-        return model
+        return self._images
+
+    def _typed_store(self, resource):
+        """Return the list of resources of the same type, if any."""
+        stores = [
+            (Scene, self._scenes),
+            (Entity, self._entities),
+            (Image, self._images)
+        ]
+        for cls, store in stores:
+            if isinstance(resource, cls):
+                return store
+        return None
+
+    def _add_resource(self, resource):
+        """Add a resource to the list of resources of the project."""
+        self._resources.append(resource)
+        store = self._typed_store(resource)
+        if store is not None:
+            store.append(resource)
+
+    def _remove_resource(self, resource):
+        """Remove a resource from the list of resources of the project."""
+        found, position = self._resources.find(resource)
+        if not found:
+            raise ValueError("The resource does not exist")
+        self._resources.remove(position)
+
+        store = self._typed_store(resource)
+        if store is not None:
+            found, position = store.find(resource)
+            if found:
+                store.remove(position)
 
     @property
     def identifier(self):
         """Return the project identifier."""
         return self._base_directory.name
 
+    @property
+    def journal(self) -> RecoveryJournal:
+        """Return the journal keeping the unsaved content of scenes."""
+        if self._journal is None:
+            path = Path(GLib.get_user_data_dir()) / "scriptorium" / "recovery"
+            self._journal = RecoveryJournal(path / f"{self.identifier}.jsonl")
+        return self._journal
+
     def create_resource(self, cls, title: str, synopsis: str = ""):
         # Create the resource
         resource = cls(self, str(uuid.uuid4()))
         resource.title = title
         resource.synopsis = synopsis
-        self._resources.append(resource)
+        self._add_resource(resource)
 
         # Keep track of the creation in the project history
         self.save_to_disk()
-        for data_file in resource.data_files:
-            self.repo.index.add(data_file)
-        self.repo.index.commit(f'Created new {cls.__gtype_name__} "{title}"')
+        data_files = resource.data_files
+        message = f'Created new {cls.__gtype_name__} "{title}"'
+
+        def commit():
+            for data_file in data_files:
+                self.repo.index.add(data_file)
+            self.repo.index.commit(message)
+
+        self.run_in_repository(commit)
 
         return resource
 
@@ -255,13 +451,8 @@ class Project(GObject.Object):
         """Delete the resource."""
         logger.info(f"Delete {resource}")
 
-        # Find it
-        found, position = self._resources.find(resource)
-        if not found:
-            raise ValueError("The resource does not exist")
-
         # Remove the resource
-        self._resources.remove(position)
+        self._remove_resource(resource)
 
         # If the resource had content we re-parent it to the manuscript root
         # in order to avoid creating orfan resources
@@ -293,21 +484,37 @@ class Project(GObject.Object):
                             if found:
                                 list_store.remove(position)
 
-        # Delete the file on disk (if any)
-        for data_file in resource.data_files:
+        # Delete the files on disk (if any) no other resource shares
+        data_files = [
+            data_file for data_file in resource.data_files
+            if not self.is_data_file_used(data_file)
+        ]
+        for data_file in data_files:
             if data_file.exists():
                 data_file.unlink()
 
         # Keep track of the deletion of this resource in the history
         self.save_to_disk()
-        for data_file in resource.data_files:
-            self.repo.index.remove(data_file)
-        self.repo.index.commit(f'Deleted resource "{resource.identifier}"')
+        message = f'Deleted resource "{resource.identifier}"'
+
+        def commit():
+            for data_file in data_files:
+                self.repo.index.remove(data_file)
+            self.repo.index.commit(message)
+
+        self.run_in_repository(commit)
 
         # Emit the signal of the resource and eventually do additional
         # actions
         resource.process_deleted()
 
+    def is_data_file_used(self, data_file: Path, ignore=None) -> bool:
+        """Tell if a resource, other than the one ignored, uses the file."""
+        for resource in self._resources:
+            if resource is not ignore and data_file in resource.data_files:
+                return True
+        return False
+
     def open(self):
         """Open the project by parsing the dict structure into objects."""
         logger.info(f"Open {self.title}")
@@ -358,7 +565,7 @@ class Project(GObject.Object):
         }
 
         # Save it
-        self._save_yaml()
+        return self._save_yaml()
 
     def get_resource(self, identifier: str):
         """Return one of the resource and load it if needed."""
@@ -410,5 +617,5 @@ class Project(GObject.Object):
                             store = resource.get_property(prop.name)
                             store.append(r)
 
-        self._resources.append(resource)
+        self._add_resource(resource)
         return resource
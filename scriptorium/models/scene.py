@@ -19,8 +19,10 @@
 """Model for storing information about manuscripts and their content."""
 
 from pathlib import Path
-from gi.repository import Gtk, GObject, Gio
-from scriptorium.utils import html_to_buffer, buffer_to_html
+from gi.repository import GObject, Gio, GLib
+from scriptorium.utils import text_to_html
+from scriptorium.utils.content_cache import ContentCache
+from scriptorium.utils.storage import WriteBatch
 from .commit_message import CommitMessage
 from .entity import Entity
 from .resource import Resource
@@ -29,6 +31,122 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Bytes of HTML kept in memory for all the scenes of all the projects, until
+# the "content-cache-budget" setting is applied
+CONTENT_CACHE_BUDGET = 32 * 1024 * 1024
+
+# The latest snapshot queued for saving of every scene not written yet, by
+# path of its content, so that it is not read from disk in the meantime
+_pending_saves = {}
+
+
+def write_scenes(contents: list):
+    """
+    Write the HTML payloads of scenes, given as (scene, html) pairs, in a
+    single batch.
+
+    The models of the UI and the repository are not touched so this can
+    run in a thread.
+    """
+    if len(contents) == 0:
+        return
+
+    with WriteBatch() as batch:
+        for scene, html_content in contents:
+            logger.info(f"{scene.title}: Saving HTML content")
+            batch.write_text(scene._scene_content_path, html_content)
+    for scene, html_content in contents:
+        Scene.content_cache.put(str(scene._scene_content_path), html_content)
+
+
+def commit_scenes(scenes: list) -> list:
+    """Commit together the content of the scenes which changed on disk, and
+    return them. This must run in the thread of the repositories."""
+    if len(scenes) == 0:
+        return []
+
+    # Check which of the files have been changed
+    repo = scenes[0].project.repo
+    changed_paths = [d.a_path for d in repo.index.diff(None)]
+    changed = []
+    for scene in scenes:
+        path = str(scene._scene_content_path.resolve())
+        if any(path.endswith(changed_path) for changed_path in changed_paths):
+            changed.append(scene)
+
+    if len(changed) > 0:
+        repo.index.add([scene._scene_content_path for scene in changed])
+        identifiers = ", ".join(f'"{scene.identifier}"' for scene in changed)
+        if len(changed) == 1:
+            repo.index.commit(f"Modified scene {identifiers}")
+        else:
+            repo.index.commit(f"Modified scenes {identifiers}")
+
+    return changed
+
+
+def save_scenes_in_background(snapshots: list):
+    """
+    Save the formatted text of scenes, given as (scene, text, segments)
+    tuples, writing and committing them in the thread of the repositories.
+    Every scene emits "saved" or "save-failed" once it is done.
+    """
+    if len(snapshots) == 0:
+        return
+
+    def save() -> dict:
+        write_scenes([
+            (scene, text_to_html(text, segments))
+            for scene, text, segments in snapshots
+        ])
+
+        # Record them in the history of their project
+        projects = {}
+        for scene, _text, _segments in snapshots:
+            projects.setdefault(scene.project, []).append(scene)
+        changed = []
+        for project_scenes in projects.values():
+            changed += commit_scenes(project_scenes)
+
+        # Return the new history of the scenes which changed
+        return {scene: scene._read_history() for scene in changed}
+
+    for snapshot in snapshots:
+        _pending_saves[str(snapshot[0]._scene_content_path)] = snapshot
+
+    # All the projects share the same thread for their repositories
+    future = snapshots[0][0].project.run_in_repository(save)
+    future.add_done_callback(
+        lambda future: GLib.idle_add(
+            _on_saved_in_background, snapshots, future
+        )
+    )
+
+
+def _on_saved_in_background(snapshots: list, future):
+    error = future.exception()
+
+    # Unless they were queued again since, the scenes can be read from disk
+    scenes = []
+    for snapshot in snapshots:
+        key = str(snapshot[0]._scene_content_path)
+        if _pending_saves.get(key) is snapshot:
+            del _pending_saves[key]
+        scenes.append(snapshot[0])
+
+    for scene in scenes:
+        if error is not None:
+            logger.error(f"{scene.title}: Could not save: {error}")
+            scene.emit("save-failed", str(error))
+        else:
+            histories = future.result()
+            if scene in histories:
+                scene._set_history(histories[scene])
+            scene.emit("saved")
+
+    # Don't repeat that callback
+    return False
+
 
 class Scene(Resource):
     """A scene is a basic building block of manuscripts."""
@@ -37,6 +155,13 @@ class Scene(Resource):
 
     entities = GObject.Property(type=Gio.ListStore)
 
+    # The HTML of the scenes recently used, shared by all the projects
+    content_cache = ContentCache(CONTENT_CACHE_BUDGET)
+
+    # Signals to inform of the outcome of a save done in the background
+    saved = GObject.Signal()
+    save_failed = GObject.Signal(arg_types=(str,))
+
     def __init__(self, project, identifier: str):
         """Create a scene."""
         super().__init__(project, identifier)
@@ -53,9 +178,6 @@ class Scene(Resource):
         if not self._scene_content_path.exists():
             self._scene_content_path.touch()
 
-        # Lazy loaded later
-        self._scene_content = None
-
         self._refresh_history()
 
     @property
@@ -88,29 +210,13 @@ class Scene(Resource):
         if found:
             self.entities.remove(position)
 
-    def load_into_buffer(self, buffer: Gtk.TextBuffer):
-        """Load the content of a text buffer from disk."""
-        logger.info(f"{self.title}: Loading info buffer")
+    def save_in_background(self, text: str, segments: list):
+        """
+        Save formatted text, as returned by get_formatted_text, in a thread.
 
-        # Load the content of the file and push to the buffer
-        html_to_buffer(self.to_html(), buffer)
-
-    def save_from_buffer(self, buffer: Gtk.TextBuffer):
-        """Save the content of a text buffer to disk."""
-        logger.info(f"{self.title}: Saving from buffer")
-
-        # Write the content of the buffer
-        self._scene_content = buffer_to_html(buffer)
-        self._scene_content_path.write_text(self._scene_content)
-
-        # Check if the file has been changed
-        repo = self.project.repo
-        for d in repo.index.diff(None):
-            if str(self._scene_content_path.resolve()).endswith(d.a_path):
-                repo.index.add(self._scene_content_path)
-                repo.index.commit(f'Modified scene "{self.identifier}"')
-                # Trigger a refresh of the commit history
-                self._refresh_history()
+        Either "saved" or "save-failed" is emitted once it is done.
+        """
+        save_scenes_in_background([(self, text, segments)])
 
     def to_html(self):
         """Return the HTML payload for the scene."""
@@ -118,15 +224,40 @@ class Scene(Resource):
         if not self._scene_content_path.exists():
             raise FileNotFoundError(f"Could not open {self._scene_content_path}")
 
+        # The content waiting to be written is more recent than the file
+        key = str(self._scene_content_path)
+        pending = _pending_saves.get(key)
+        if pending is not None:
+            _scene, text, segments = pending
+            return text_to_html(text, segments)
+
         # Load from disk if we need to
-        if self._scene_content is None:
+        html_content = Scene.content_cache.get(key)
+        if html_content is None:
             logger.info(f"Loading raw HTML from {self._scene_content_path}")
-            self._scene_content = Path(self._scene_content_path).read_text()
+            html_content = Path(self._scene_content_path).read_text()
+            Scene.content_cache.put(key, html_content)
 
-        return self._scene_content
+        return html_content
 
     def _refresh_history(self):
-        self._history.remove_all()
+        """Read the history of commits about the scene in the background."""
+        future = self.project.run_in_repository(self._read_history)
+        future.add_done_callback(
+            lambda future: GLib.idle_add(self._on_history_read, future)
+        )
+
+    def _on_history_read(self, future):
+        if future.exception() is None:
+            self._set_history(future.result())
+
+        # Don't repeat that callback
+        return False
+
+    def _read_history(self) -> list:
+        """Return the (date, message) of the commits about the scene. This
+        must run in the thread of the repositories."""
+        history = []
         commits = self.project.repo.iter_commits(
             all=True,
             paths=self._scene_content_path
@@ -134,8 +265,13 @@ class Scene(Resource):
         for commit in commits:
             datetime = commit.committed_datetime
             message_datetime = datetime.strftime("%A %d %B %Y, %H:%M:%S")
-            message = commit.message.strip()
-            msg = CommitMessage(message_datetime, message)
-            self._history.append(msg)
+            history.append((message_datetime, commit.message.strip()))
+        return history
+
+    def _set_history(self, history: list):
+        self._history.splice(0, self._history.get_n_items(), [
+            CommitMessage(message_datetime, message)
+            for message_datetime, message in history
+        ])
 
 
@@ -1,89 +1,157 @@
-
-
-from gi.repository import Gtk
-from bs4 import BeautifulSoup
-
-import io
-
-import logging
-
-logger = logging.getLogger(__name__)
-
-
-def html_to_buffer(html_content: str, buffer: Gtk.TextBuffer):
-    """
-    Turn the content of an HTML payload into TextBuffer content with tags
+"""Helpers shared across Scriptorium.
+
+The Gtk specific helpers live in their own modules so that this package can
+be imported without a display stack.
+"""
+from html import escape
+from html.parser import HTMLParser
+
+# The tags which are part of the content of scenes
+FORMATTING_TAGS = ("em", "strong")
+
+
+class _SceneParser(HTMLParser):
+    """Parse the HTML of a scene in one pass into text and tag spans."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._chunks = []
+        self._length = 0
+        self._in_paragraph = False
+        self._open_tags = []
+        self.spans = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def _append(self, text: str):
+        self._chunks.append(text)
+        self._length += len(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "p":
+            self._in_paragraph = True
+        elif self._in_paragraph:
+            self._open_tags.append((tag, self._length))
+
+    def handle_endtag(self, tag):
+        if tag == "p":
+            # Close whatever was left open in the paragraph
+            while len(self._open_tags) > 0:
+                self.handle_endtag(self._open_tags[-1][0])
+            self._in_paragraph = False
+            self._append("\n\n")
+            return
+
+        # Close the innermost matching tag, ignore the stray ones
+        for index in range(len(self._open_tags) - 1, -1, -1):
+            name, start = self._open_tags[index]
+            if name == tag:
+                del self._open_tags[index]
+                if start < self._length:
+                    self.spans.append((name, start, self._length))
+                break
+
+    def handle_data(self, data):
+        if self._in_paragraph:
+            self._append(data)
+
+
+def parse_html(html_content: str):
+    """Parse the HTML of a scene into its text and a list of tag spans.
+
+    The paragraphs are laid out as in the editor, each followed by an empty
+    line. The spans are (tag name, start offset, end offset) tuples.
     """
-
-    # Process the lines and populate the buffer
-    soup = BeautifulSoup(html_content, 'html.parser')
-    paragraphs = soup.find_all('p')
-    for paragraph in paragraphs:
-        for child in paragraph.children:
-            text = child.get_text()
-            if len(text) > 1:
-                start = buffer.get_end_iter()
-                if child.name:
-                    buffer.insert_with_tags_by_name(start, text, child.name)
-                else:
-                    buffer.insert(start, text)
-        start = buffer.get_end_iter()
-        buffer.insert(start, "\n\n")
-
-    # Place the cursor at the start of the buffer
-    start = buffer.get_start_iter()
-    buffer.place_cursor(start)
-
-
-def buffer_to_html(buffer: Gtk.TextBuffer):
+    parser = _SceneParser()
+    parser.feed(html_content)
+    parser.close()
+    return parser.text, parser.spans
+
+
+def html_to_text(html_content: str) -> str:
+    """Return the plain text of a scene, with paragraphs laid out as in the
+    editor."""
+    return parse_html(html_content)[0]
+
+
+class _HtmlWriter(object):
+    """Write paragraphs with properly nested formatting tags."""
+
+    def __init__(self):
+        self._output = []
+        self._paragraph = []
+        self._open_tags = []
+
+    def write(self, text: str, tags):
+        """Write a piece of text formatted with a set of tags."""
+        text = text.replace("\ufffc", "")
+        if text == "":
+            return
+
+        # Close the tags that should not apply anymore, and those inside them
+        keep = 0
+        while keep < len(self._open_tags) and self._open_tags[keep] in tags:
+            keep += 1
+        for name in reversed(self._open_tags[keep:]):
+            self._paragraph.append(f"</{name}>")
+        del self._open_tags[keep:]
+
+        # Open the missing ones
+        for name in sorted(tags):
+            if name not in self._open_tags:
+                self._paragraph.append(f"<{name}>")
+                self._open_tags.append(name)
+
+        self._paragraph.append(escape(text, quote=False))
+
+    def end_paragraph(self):
+        """Close the current paragraph, dropping it if it is empty."""
+        if len(self._paragraph) == 0:
+            return
+
+        for name in reversed(self._open_tags):
+            self._paragraph.append(f"</{name}>")
+        self._open_tags = []
+
+        if len(self._output) == 0:
+            self._output.append('<p class="first-paragraph">')
+        else:
+            self._output.append('<p>')
+        self._output.extend(self._paragraph)
+        self._output.append('</p>\n')
+        self._paragraph = []
+
+    def getvalue(self) -> str:
+        self.end_paragraph()
+        return "".join(self._output)
+
+
+def text_to_html(text: str, segments) -> str:
+    """Serialize formatted text into the HTML of a scene.
+
+    The segments are (end offset, tag names) tuples covering the text in
+    order. Paragraphs are separated by empty lines, as in the editor.
     """
-    Turn the content of a TextBuffer content with tags into a HTML payload
-    """
-
-    html_content = []
+    writer = _HtmlWriter()
 
-    # Extract all the text
-    iterator = buffer.get_start_iter()
-    end_iter = buffer.get_end_iter()
-    while not iterator.equal(end_iter):
-        # Find the next tag
-        next_toggle = iterator.copy()
-        if not next_toggle.forward_to_tag_toggle():
-            next_toggle = end_iter.copy()
+    position = 0
+    next_break = text.find("\n\n")
+    for end, tags in segments:
+        # Write the paragraphs which end within this segment
+        while next_break != -1 and next_break < end:
+            writer.write(text[position:next_break], tags)
+            writer.end_paragraph()
+            position = next_break + 2
+            next_break = text.find("\n\n", position)
 
-        # Extract the current text
-        segment_text = buffer.get_text(iterator, next_toggle, True)
+        # And then what is left of the segment
+        if position < end:
+            writer.write(text[position:end], tags)
+            position = end
 
-        # Apply tags
-        segment_html = segment_text
-        tags = iterator.get_tags()
-        for tag in tags:
-            tag_id = tag.get_property('name')
-            segment_html = f"<{tag_id}>{segment_html}</{tag_id}>"
-
-        # Append that piece of text
-        html_content.append(segment_html)
-
-        # Move on
-        iterator = next_toggle.copy()
-
-    # Split according to paragraphs
-    paragraphs = ''.join(html_content).split('\n\n')
-
-    buffer = io.StringIO()
-    first_paragraph = True
-    for paragraph in paragraphs:
-        if paragraph != '':
-            if first_paragraph:
-                first_paragraph = False
-                buffer.write(f'<p class="first-paragraph">{paragraph}</p>\n')
-            else:
-                buffer.write(f'<p>{paragraph}</p>\n')
-
-    content = buffer.getvalue()
-    buffer.close()
-
-    return content
+    return writer.getvalue()
 
 
 def get_child_at(widget, position):
@@ -103,22 +171,3 @@ def get_child_at(widget, position):
         widget.get_last_child()
 
     return child
-
-def switch_tag_for_selection(text_buffer, tag_name):
-    if not text_buffer.get_has_selection():
-        return
-    tag = text_buffer.get_tag_table().lookup(tag_name)
-    start, end = text_buffer.get_selection_bounds()
-
-    iter_ = start.copy()
-    full_tagged = True
-
-    while iter_.compare(end) < 0 and full_tagged:
-        full_tagged = full_tagged & iter_.has_tag(tag)
-        iter_.forward_char()
-
-    if full_tagged:
-        text_buffer.remove_tag(tag, start, end)
-    else:
-        text_buffer.apply_tag(tag, start, end)
-
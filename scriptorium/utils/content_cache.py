@@ -0,0 +1,140 @@
+# utils/content_cache.py
+#
+# Copyright 2025 Christophe Gueret
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""A cache of text content bounded by the memory it uses."""
+
+from collections import OrderedDict
+import logging
+import sys
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class ContentCache(object):
+    """
+    Least recently used cache of strings, within a budget of bytes.
+
+    When over budget the least recently used entries are compressed first,
+    if compression is enabled, and dropped if that is not enough. The
+    cache can be used from several threads.
+    """
+
+    def __init__(self, budget: int, compress: bool = True):
+        self._budget = budget
+        self._compress = compress
+        self._lock = threading.Lock()
+
+        # Values, or their compressed form, from least to most recently used
+        self._entries = OrderedDict()
+        self._size = 0
+
+        self._statistics = {
+            "hits": 0,
+            "misses": 0,
+            "decompressions": 0,
+            "compressions": 0,
+            "evictions": 0,
+        }
+
+    @property
+    def budget(self) -> int:
+        return self._budget
+
+    @budget.setter
+    def budget(self, budget: int):
+        with self._lock:
+            self._budget = budget
+            self._shrink()
+
+    def get(self, key: str) -> str:
+        """Return the value stored for the key, or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self._statistics["misses"] += 1
+                return None
+
+            self._statistics["hits"] += 1
+            self._entries.move_to_end(key)
+
+            # Used again, keep it uncompressed for a while
+            if isinstance(value, bytes):
+                self._statistics["decompressions"] += 1
+                self._size -= sys.getsizeof(value)
+                value = zlib.decompress(value).decode("utf-8")
+                self._entries[key] = value
+                self._size += sys.getsizeof(value)
+                self._shrink()
+
+            return value
+
+    def put(self, key: str, value: str):
+        """Store the value for the key, replacing the previous one."""
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = value
+            self._size += sys.getsizeof(value)
+            self._shrink()
+
+    def discard(self, key: str):
+        """Forget about the value of a key, if any."""
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def statistics(self) -> dict:
+        """Return the counts of hits and misses and the memory used."""
+        with self._lock:
+            statistics = dict(self._statistics)
+            statistics["entries"] = len(self._entries)
+            statistics["size"] = self._size
+            statistics["budget"] = self._budget
+        return statistics
+
+    def _discard(self, key: str):
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self._size -= sys.getsizeof(value)
+
+    def _shrink(self):
+        """Compress and then drop the least recently used entries until the
+        cache fits in its budget."""
+        if self._compress:
+            # The most recently used entry is always kept as it is
+            keys = list(self._entries.keys())[:-1]
+            for key in keys:
+                if self._size <= self._budget:
+                    break
+                value = self._entries[key]
+                if isinstance(value, str):
+                    compressed = zlib.compress(value.encode("utf-8"))
+                    self._entries[key] = compressed
+                    self._size += sys.getsizeof(compressed)
+                    self._size -= sys.getsizeof(value)
+                    self._statistics["compressions"] += 1
+
+        while self._size > self._budget and len(self._entries) > 1:
+            _key, value = self._entries.popitem(last=False)
+            self._size -= sys.getsizeof(value)
+            self._statistics["evictions"] += 1
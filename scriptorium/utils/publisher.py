@@ -16,17 +16,57 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
-from gi.repository import Gio
+from gi.repository import Gio, GLib
 from scriptorium.models import Resource, Manuscript, Chapter, Scene
 from scriptorium.globals import BASE
 from ebooklib import epub
 from jinja2 import Environment, PackageLoader, select_autoescape
 
-import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import functools
+import hashlib
+import os
+import threading
 
 import logging
 logger = logging.getLogger(__name__)
 
+# Number of threads reading and hashing the scenes, and rendering the parts
+RENDER_THREADS = os.cpu_count() or 1
+
+# Options of the EPUB writer. Looking for page breaks asks every part for its
+# content a second time, which renders it twice when streamed, and the parts
+# have none anyway
+WRITE_OPTIONS = {"epub3_pages": False}
+
+
+def load_style() -> str:
+    """Return the CSS of the books."""
+    return Gio.File.new_for_uri(
+        f"resource:/{BASE}/utils/epub-novel.css"
+    ).load_contents()[1].decode()
+
+
+def render_part(plan: list) -> str:
+    """Concatenate the HTML of a part, as planned by _get_chapter_plan.
+
+    This runs in worker threads, the scenes are only asked for their HTML.
+    """
+    return "".join(
+        item.to_html() if isinstance(item, Scene) else item for item in plan
+    )
+
+
+def _render_safely(function, *args):
+    """Return what the function returns, or None if it failed so that the
+    part is prepared again when the book is assembled."""
+    try:
+        return function(*args)
+    except Exception as e:
+        logger.error(f"Could not render a part: {e}")
+        return None
+
+
 # Create instances of PublisherSection and return the toc. When asked to export
 # the book call the rest of the epub lib functions
 # Need a separate call to get the CSS to render in the app. Maybe wrap that into a separate styling object
@@ -46,6 +86,17 @@ class Publisher(object):
         # The EBook built from the manuscript
         self._book = None
 
+        # What the book was built from, to know when to build it again
+        self._book_signature = None
+
+        # The parts rendered for the top level entries of the manuscript,
+        # by identifier, along with the signature they were rendered from
+        self._parts = {}
+
+        # The digests of the content of scenes, by path, along with the
+        # modification time and size of the file they were computed for
+        self._digests = {}
+
         # Load the templates
         self._env = Environment(
             loader=PackageLoader("scriptorium"),
@@ -59,97 +110,269 @@ class Publisher(object):
 
         return self._book.toc
 
-    def rebuild(self):
+    def rebuild(self) -> bool:
+        """Build the book again if the manuscript changed, return True if
+        it did."""
+        if self._book is not None and self._signature() == self._book_signature:
+            logger.info("The book is up to date")
+            return False
+
         self._build()
+        return True
 
-    def _get_chapter_content(self, resource: Resource):
-        # Create the buffer if needed
-        buffer = io.StringIO()
+    def rebuild_async(self, on_progress, on_done, cancellable=None):
+        """
+        Build the book again if the manuscript changed. The scenes are read
+        and hashed, and the parts which changed rendered, in worker threads.
+
+        The callbacks are called from the main loop: on_progress(done, total)
+        after each part once one had to be rendered, and on_done(changed) at
+        the end, changed being None if the cancellable was cancelled.
+        """
+        # Only walk through the models here, everything else is done in
+        # the threads
+        metadata, outline = self._outline()
+        known = {
+            identifier: part_signature
+            for identifier, (part_signature, _part) in self._parts.items()
+        }
+        book_signature = None
+        if self._book is not None:
+            book_signature = self._book_signature
+
+        def prepare(key, plan):
+            entry_signature = self._entry_signature(key, plan)
+            if known.get(key[0]) == entry_signature:
+                return entry_signature, None
+            return entry_signature, render_part(plan)
+
+        def run():
+            total = len(outline)
+            results = [None] * total
+            done = 0
+            rendering = False
+
+            # Reading the scenes waits for the disk and hashing them runs
+            # without the GIL, so threads use the cores. The parts are only
+            # turned into XHTML by ebooklib when shown or written
+            executor = ThreadPoolExecutor(
+                max_workers=RENDER_THREADS, thread_name_prefix="publish"
+            )
+            futures = {
+                executor.submit(prepare, key, plan): index
+                for index, (_entry, key, plan) in enumerate(outline)
+            }
+            for future in as_completed(futures):
+                if cancellable is not None and cancellable.is_cancelled():
+                    break
+                result = _render_safely(future.result)
+                results[futures[future]] = result
+                done += 1
+
+                # Checking the parts which did not change is quick, only
+                # show the progress once some have to be rendered
+                if result is not None and result[1] is not None:
+                    rendering = True
+                if rendering:
+                    GLib.idle_add(on_progress, done, total)
+            executor.shutdown(wait=False, cancel_futures=True)
+
+            GLib.idle_add(
+                self._on_rendered, metadata, outline, results,
+                book_signature, on_done, cancellable
+            )
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _on_rendered(self, metadata, outline, results, book_signature,
+                     on_done, cancellable):
+        """Assemble the book once its parts are checked and rendered."""
+        if cancellable is not None and cancellable.is_cancelled():
+            logger.info("Building the book was cancelled")
+            on_done(None)
+            return False
+
+        # Build everything here if a part could not be prepared
+        if None in results:
+            self._build()
+            on_done(True)
+            return False
+
+        signature = (*metadata, tuple(result[0] for result in results))
+        if signature == book_signature:
+            logger.info("The book is up to date")
+            on_done(False)
+            return False
+
+        entries = [entry for entry, _key, _plan in outline]
+        rendered = {
+            entry.identifier: content
+            for entry, (_signature, content) in zip(entries, results)
+            if content is not None
+        }
+        self._build(signature, entries, rendered)
+        on_done(True)
+
+        # Don't repeat that callback
+        return False
+
+    def _scene_digest(self, scene: Scene) -> str:
+        """Return a digest of the content of the scene. This can run in a
+        thread."""
+        path = scene.data_files[0]
+        stat = path.stat()
+        known = self._digests.get(path)
+        if known is not None and known[0] == (stat.st_mtime_ns, stat.st_size):
+            return known[1]
+
+        digest = hashlib.sha1(scene.to_html().encode()).hexdigest()
+        self._digests[path] = ((stat.st_mtime_ns, stat.st_size), digest)
+        return digest
+
+    def _outline(self) -> tuple:
+        """
+        Return the metadata of the book and its outline, with the entry,
+        the (identifier, title) and the plan of every part. Only the models
+        are walked through, no scene is read.
+        """
+        cover = self._manuscript.cover
+        metadata = (
+            self._manuscript.identifier,
+            self._manuscript.title,
+            cover.path if cover is not None else None,
+        )
+        outline = [
+            (
+                entry, (entry.identifier, entry.title),
+                self._get_chapter_plan(entry)
+            )
+            for entry in self._manuscript.content
+        ]
+        return metadata, outline
+
+    def _entry_signature(self, key: tuple, plan: list) -> tuple:
+        """Return what the rendering of a part depends on: its identifier
+        and title, the headers and the digests of its scenes. This can run
+        in a thread."""
+        return key + (tuple(
+            self._scene_digest(item) if isinstance(item, Scene) else item
+            for item in plan
+        ),)
+
+    def _signature(self) -> tuple:
+        """Return what the whole book depends on."""
+        metadata, outline = self._outline()
+        return (*metadata, tuple(
+            self._entry_signature(key, plan) for _entry, key, plan in outline
+        ))
+
+    def _get_chapter_plan(self, resource: Resource) -> list:
+        """Return the pieces of HTML making a chapter, scenes included as
+        they are to be read later."""
+        plan = []
 
         # Recursively extract the content of the chapter/scenes tree
-        self._extract_content(resource, 1, buffer)
+        self._extract_content(resource, 1, plan)
 
-        # Close and return the buffer
-        content = buffer.getvalue()
-        buffer.close()
+        return plan
 
-        return content
+    def _get_chapter_content(self, resource: Resource):
+        return render_part(self._get_chapter_plan(resource))
 
-    def _extract_content(self, resource: Resource, depth, buffer, previous_was_scene = False):
+    def _extract_content(self, resource: Resource, depth, plan, previous_was_scene = False):
         # If we just have a resource return that as is
         if isinstance(resource, Scene):
             # If what we wrote before was a scene, add a scene separator
             if previous_was_scene:
-                buffer.write('<p class="separator">&nbsp;</p>\n')
-            buffer.write(resource.to_html())
+                plan.append('<p class="separator">&nbsp;</p>\n')
+            plan.append(resource)
 
         # If we are in a Chapter add the header and recurse into the content
         if isinstance(resource, Chapter):
             if depth == 1:
-                buffer.write(f'<h{depth} class="chapter-title">{resource.title}</h{depth}>\n')
+                plan.append(f'<h{depth} class="chapter-title">{resource.title}</h{depth}>\n')
             else:
-                buffer.write(f"<h{depth}>{resource.title}</h{depth}>\n")
+                plan.append(f"<h{depth}>{resource.title}</h{depth}>\n")
 
             # We keep track of the content just before to place scene separators
             previous_entry = None
             for entry in resource.content:
                 self._extract_content(
-                    entry, depth+1, buffer,
+                    entry, depth+1, plan,
                     isinstance(previous_entry, Scene)
                 )
                 previous_entry = entry
 
     def save(self, target_file: str):
-        if self._book is None:
-            self._build()
+        """
+        Write the EPUB to a file. Parts are rendered as they are written
+        and forgotten right after, so the memory needed does not grow with
+        the size of the book. The content is the same as the book shown.
+        """
+        book = self._new_book(stream=True)
+
+        parts = []
+        for entry in self._manuscript.content:
+            part = self._new_part(
+                entry, _StreamedEpubHtml,
+                render=functools.partial(self._get_chapter_content, entry)
+            )
+            book.add_item(part)
+            book.toc += (part,)
+            parts.append(part)
 
-        epub.write_epub(target_file, self._book, {})
+        self._finish_book(book, parts)
+        epub.write_epub(target_file, book, WRITE_OPTIONS)
 
-    def _build(self):
-        """Build a EPUB from the content of the manuscript."""
-        # Initialise the book
-        self._book = epub.EpubBook()
-        self._book.set_identifier(self._manuscript.identifier)
-        self._book.set_title(self._manuscript.title)
-        self._book.set_language("en")
-        self._book.toc = ()
+    def _new_book(self, stream: bool = False) -> epub.EpubBook:
+        """Create a book with the metadata and the cover of the manuscript,
+        the cover being read only when written if streamed."""
+        book = epub.EpubBook()
+        book.set_identifier(self._manuscript.identifier)
+        book.set_title(self._manuscript.title)
+        book.set_language("en")
+        book.toc = ()
 
         # Set the cover
         cover_img = self._manuscript.cover
         if cover_img is not None:
-            self._book.set_cover(
-                cover_img.path.name,
-                open(cover_img.path, 'rb').read()
-            )
+            cover_path = cover_img.path
+            if stream:
+                book.set_cover(cover_path.name, b"")
+                cover = book.get_item_with_id("cover-img")
+                cover.get_content = lambda default=None: cover_path.read_bytes()
+            else:
+                book.set_cover(cover_path.name, cover_path.read_bytes())
 
-        # Add the content
-        for entry in self._manuscript.content:
-            slug = entry.title.lower().replace(' ', '_')
-            epub_html = epub.EpubHtml(
-                title=entry.title,
-                file_name=f"{slug}.xhtml",
-                lang="en"
-            )
-            epub_html.set_content(self._get_chapter_content(entry))
-            self._book.add_item(epub_html)
-            self._book.toc += (epub_html,)
+        return book
 
+    def _new_part(self, entry: Resource, cls=epub.EpubHtml, **kwargs):
+        """Create the item of the book for a top level entry."""
+        slug = entry.title.lower().replace(' ', '_')
+        return cls(
+            uid=f"part-{entry.identifier}",
+            title=entry.title,
+            file_name=f"{slug}.xhtml",
+            lang="en",
+            **kwargs
+        )
+
+    def _finish_book(self, book: epub.EpubBook, new_parts: list):
+        """Add the spine, navigation and style to a book with its parts."""
         # Define the spine
-        self._book.spine = []
-        if cover_img is not None:
-            self._book.spine.append("cover")
-        self._book.spine.append("nav")
-        for part in self._book.toc:
-            self._book.spine.append(part)
+        book.spine = []
+        if self._manuscript.cover is not None:
+            book.spine.append("cover")
+        book.spine.append("nav")
+        for part in book.toc:
+            book.spine.append(part)
 
         # add default NCX and Nav file
-        self._book.add_item(epub.EpubNcx())
-        self._book.add_item(epub.EpubNav())
+        book.add_item(epub.EpubNcx())
+        book.add_item(epub.EpubNav())
 
         # define CSS style
-        style = Gio.File.new_for_uri(
-            f"resource:/{BASE}/utils/epub-novel.css"
-        ).load_contents()[1].decode()
+        style = load_style()
         style_css = epub.EpubItem(
             uid="style_novel",
             file_name="style/novel.css",
@@ -158,9 +381,71 @@ class Publisher(object):
         )
 
         # Add the CSS file to the book
-        self._book.add_item(style_css)
+        book.add_item(style_css)
 
-        # Connect it to all the parts
-        for part in self._book.toc:
+        # Connect it to all the new parts, the others already are
+        for part in new_parts:
             part.add_item(style_css)
 
+    def _build(self, signature=None, entries=None, rendered=None):
+        """
+        Build a EPUB from the content of the manuscript. The signature of
+        the manuscript, its entries and the content of some of them can be
+        given if they were computed already.
+        """
+        if signature is None:
+            signature = self._signature()
+            entries = list(self._manuscript.content)
+        if rendered is None:
+            rendered = {}
+        self._book_signature = signature
+        entry_signatures = signature[3]
+
+        # Initialise the book
+        self._book = self._new_book()
+
+        # Add the content, only rendering the entries which changed
+        parts = {}
+        new_parts = []
+        for entry, entry_signature in zip(entries, entry_signatures):
+            known = self._parts.get(entry.identifier)
+            if known is not None and known[0] == entry_signature:
+                epub_html = known[1]
+            else:
+                logger.info(f"Rendering {entry.title}")
+                epub_html = self._new_part(entry)
+                content = rendered.get(entry.identifier)
+                if content is None:
+                    content = self._get_chapter_content(entry)
+                epub_html.set_content(content)
+                new_parts.append(epub_html)
+            parts[entry.identifier] = (entry_signature, epub_html)
+            self._book.add_item(epub_html)
+            self._book.toc += (epub_html,)
+        self._parts = parts
+
+        self._finish_book(self._book, new_parts)
+
+
+class _StreamedEpubHtml(epub.EpubHtml):
+    """
+    A part of a book rendered whenever its content is needed and forgotten
+    right after, so that only one part is held in memory at a time
+    """
+
+    def __init__(self, render, **kwargs):
+        super().__init__(**kwargs)
+        self._render = render
+
+    def get_content(self, default=None):
+        return self._with_content(super().get_content, default)
+
+    def get_body_content(self):
+        return self._with_content(super().get_body_content)
+
+    def _with_content(self, method, *args):
+        self.content = self._render()
+        try:
+            return method(*args)
+        finally:
+            self.content = ""
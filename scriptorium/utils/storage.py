@@ -0,0 +1,181 @@
+# utils/storage.py
+#
+# Copyright 2025 Christophe Gueret
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Atomic writes of the files of projects, batched to limit the syncs."""
+
+from pathlib import Path
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Statistics about all the flushes done, shared by all the threads
+_statistics_lock = threading.Lock()
+_statistics = {
+    "flushes": 0,
+    "files": 0,
+    "bytes": 0,
+    "total_seconds": 0.0,
+    "max_seconds": 0.0,
+}
+
+
+def get_write_statistics() -> dict:
+    """Return the number of flushes, files and bytes written, and the time
+    spent writing them."""
+    with _statistics_lock:
+        statistics = dict(_statistics)
+    if statistics["flushes"] > 0:
+        statistics["mean_seconds"] = (
+            statistics["total_seconds"] / statistics["flushes"]
+        )
+    else:
+        statistics["mean_seconds"] = 0.0
+    return statistics
+
+
+def reset_write_statistics():
+    """Start counting the writes again from zero."""
+    with _statistics_lock:
+        _statistics.update(
+            flushes=0, files=0, bytes=0, total_seconds=0.0, max_seconds=0.0
+        )
+
+
+def describe_write_statistics() -> str:
+    """Return a summary of the writes done so far, to report them."""
+    statistics = get_write_statistics()
+    return (
+        f"Wrote {statistics['files']} files ({statistics['bytes']} bytes) "
+        f"in {statistics['flushes']} flushes, "
+        f"{statistics['mean_seconds'] * 1000:.1f} ms on average and "
+        f"{statistics['max_seconds'] * 1000:.1f} ms at most"
+    )
+
+
+class WriteBatch(object):
+    """
+    Files to write atomically, all made durable by a single flush.
+
+    Every file is written next to its target and renamed over it once all
+    of them are synced, so a crash leaves either the old or the new
+    content, never a truncated file. The directories are synced once each
+    however many files they received.
+
+    Used as a context manager the batch is flushed on exit, unless an
+    exception was raised.
+    """
+
+    def __init__(self):
+        # The content to write, by target path
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, _exception, _traceback):
+        if exception_type is None:
+            self.flush()
+        else:
+            self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def write_text(self, path: Path, content: str):
+        """Queue a text file to write."""
+        self.write_bytes(path, content.encode("utf-8"))
+
+    def write_bytes(self, path: Path, content: bytes):
+        """Queue a file to write, replacing anything queued for it."""
+        self._pending[Path(path)] = content
+
+    def flush(self):
+        """Write all the files queued."""
+        if len(self._pending) == 0:
+            return
+        pending, self._pending = self._pending, {}
+        start = time.monotonic()
+
+        # Write and sync all the temporary files first
+        temporary_paths = {}
+        try:
+            for path, content in pending.items():
+                temporary_path = path.with_name(
+                    f".{path.name}.{uuid.uuid4().hex[:8]}.tmp"
+                )
+                temporary_paths[path] = temporary_path
+                with open(temporary_path, "wb") as output:
+                    output.write(content)
+                    output.flush()
+                    os.fsync(output.fileno())
+        except OSError:
+            for temporary_path in temporary_paths.values():
+                temporary_path.unlink(missing_ok=True)
+            raise
+
+        # Then swap them in and make the renames durable
+        for path, temporary_path in temporary_paths.items():
+            os.replace(temporary_path, path)
+        for directory in set(path.parent for path in pending):
+            _sync_directory(directory)
+
+        elapsed = time.monotonic() - start
+        size = sum(len(content) for content in pending.values())
+        logger.debug(
+            f"Wrote {len(pending)} files ({size} bytes) in "
+            f"{elapsed * 1000:.1f} ms"
+        )
+        with _statistics_lock:
+            _statistics["flushes"] += 1
+            _statistics["files"] += len(pending)
+            _statistics["bytes"] += size
+            _statistics["total_seconds"] += elapsed
+            _statistics["max_seconds"] = max(
+                _statistics["max_seconds"], elapsed
+            )
+
+
+def _sync_directory(directory: Path):
+    """Sync a directory so that the files renamed in it stay renamed."""
+    try:
+        descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:
+        # Some platforms don't allow opening directories
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+
+def atomic_write_text(path: Path, content: str):
+    """Write a single text file atomically."""
+    with WriteBatch() as batch:
+        batch.write_text(path, content)
+
+
+def atomic_write_bytes(path: Path, content: bytes):
+    """Write a single binary file atomically."""
+    with WriteBatch() as batch:
+        batch.write_bytes(path, content)
@@ -0,0 +1,325 @@
+# utils/text_buffer.py
+#
+# Copyright 2025 Christophe Gueret
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Conversions between the HTML of scenes and Gtk text buffers."""
+
+from gi.repository import Gtk, GLib
+from scriptorium.utils import parse_html, text_to_html, FORMATTING_TAGS
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of characters loaded right away, and then at every idle iteration
+FIRST_CHUNK_SIZE = 4000
+CHUNK_SIZE = 20000
+
+
+def html_to_buffer(html_content: str, buffer: Gtk.TextBuffer):
+    """
+    Turn the content of an HTML payload into TextBuffer content with tags
+    """
+
+    # Parse everything first and then fill the buffer in one insert
+    text, spans = parse_html(html_content)
+    fill_buffer(buffer, text, spans)
+
+    # Place the cursor at the start of the buffer
+    start = buffer.get_start_iter()
+    buffer.place_cursor(start)
+
+
+def fill_buffer(buffer: Gtk.TextBuffer, text: str, spans: list):
+    """
+    Append parsed text to the buffer and apply the tags of its spans
+    """
+    base_offset = buffer.get_char_count()
+    buffer.insert(buffer.get_end_iter(), text)
+
+    # Apply all the tags, ignoring those the buffer does not know about
+    tag_table = buffer.get_tag_table()
+    for name, start, end in spans:
+        tag = tag_table.lookup(name)
+        if tag is None:
+            logger.debug(f"Ignoring unknown tag {name}")
+            continue
+        buffer.apply_tag(
+            tag,
+            buffer.get_iter_at_offset(base_offset + start),
+            buffer.get_iter_at_offset(base_offset + end)
+        )
+
+
+class ProgressiveLoader(object):
+    """
+    Fill a buffer with the content of a scene in chunks, without blocking
+    """
+
+    def __init__(self, buffer: Gtk.TextBuffer, html_content: str, on_done,
+                 parsed: tuple = None):
+        self._buffer = buffer
+        self._on_done = on_done
+
+        # The content may have been parsed already, e.g. by a prefetcher
+        if parsed is None:
+            parsed = parse_html(html_content)
+        self._text, spans = parsed
+
+        # Tags are applied once all their text is in the buffer
+        self._spans = sorted(spans, key=lambda span: span[2])
+        self._next_span = 0
+
+        self._base_offset = 0
+        self._position = 0
+        self._source_id = None
+
+    @property
+    def is_loading(self) -> bool:
+        return self._position < len(self._text) or self._source_id is not None
+
+    def start(self):
+        """Load the first chunk now and the rest when the loop is idle."""
+        self._base_offset = self._buffer.get_char_count()
+        self._load_chunk(FIRST_CHUNK_SIZE)
+        self._buffer.place_cursor(self._buffer.get_start_iter())
+
+        if self._position < len(self._text):
+            self._source_id = GLib.idle_add(
+                self._on_idle, priority=GLib.PRIORITY_DEFAULT_IDLE
+            )
+        else:
+            self._on_done()
+
+    def cancel(self):
+        """Stop loading, leaving the buffer partially filled."""
+        if self._source_id is not None:
+            GLib.source_remove(self._source_id)
+            self._source_id = None
+        self._position = len(self._text)
+
+    def _on_idle(self):
+        self._load_chunk(CHUNK_SIZE)
+        if self._position < len(self._text):
+            return True
+
+        self._source_id = None
+        self._on_done()
+        return False
+
+    def _load_chunk(self, size: int):
+        """Append the next paragraphs and the tags they complete."""
+        end = self._text.find("\n\n", self._position + size)
+        end = len(self._text) if end == -1 else end + 2
+
+        self._buffer.begin_irreversible_action()
+        self._buffer.insert(
+            self._buffer.get_end_iter(), self._text[self._position:end]
+        )
+        self._position = end
+
+        tag_table = self._buffer.get_tag_table()
+        while self._next_span < len(self._spans):
+            name, start, span_end = self._spans[self._next_span]
+            if span_end > self._position:
+                break
+            self._next_span += 1
+            tag = tag_table.lookup(name)
+            if tag is not None:
+                self._buffer.apply_tag(
+                    tag,
+                    self._buffer.get_iter_at_offset(self._base_offset + start),
+                    self._buffer.get_iter_at_offset(self._base_offset + span_end)
+                )
+        self._buffer.end_irreversible_action()
+
+
+class WordCounter(object):
+    """
+    Keep count of the words of a buffer as it is being edited, and of the
+    lines edited since they were last taken for checking
+    """
+
+    def __init__(self, buffer: Gtk.TextBuffer):
+        self._buffer = buffer
+
+        # Words never span several lines so we keep one count per line
+        self._line_counts = []
+        self._total = 0
+        self._deleted_lines = None
+        self._dirty_lines = set()
+        self.reset()
+
+        buffer.connect_after("insert-text", self.on_insert_text)
+        buffer.connect("delete-range", self.on_before_delete_range)
+        buffer.connect_after("delete-range", self.on_delete_range)
+
+    @property
+    def total(self) -> int:
+        """The number of words in the buffer."""
+        return self._total
+
+    @property
+    def paragraph_counts(self) -> list:
+        """The number of words of every line of the buffer, empty lines
+        separating paragraphs included."""
+        return list(self._line_counts)
+
+    def reset(self):
+        """Count all the words of the buffer again."""
+        self._line_counts = [
+            self._count_line(line)
+            for line in range(self._buffer.get_line_count())
+        ]
+        self._total = sum(self._line_counts)
+        self.mark_all_dirty()
+
+    def take_dirty_lines(self) -> list:
+        """Return the lines edited since the last call, in order."""
+        lines = sorted(self._dirty_lines)
+        self._dirty_lines = set()
+        return lines
+
+    def mark_dirty(self, lines):
+        """Have some lines returned again by take_dirty_lines."""
+        self._dirty_lines.update(lines)
+
+    def mark_all_dirty(self):
+        self._dirty_lines = set(range(len(self._line_counts)))
+
+    def _count_line(self, line: int) -> int:
+        _found, start = self._buffer.get_iter_at_line(line)
+        end = start.copy()
+        if not end.ends_line():
+            end.forward_to_line_end()
+        return len(self._buffer.get_text(start, end, False).split())
+
+    def _replace_lines(self, first: int, last: int, new_lines: int):
+        """Replace the counts of the lines first to last (included) by the
+        counts of the lines now starting at first."""
+        counts = [self._count_line(first + i) for i in range(new_lines)]
+        old_counts = self._line_counts[first:last + 1]
+        self._total += sum(counts) - sum(old_counts)
+        self._line_counts[first:last + 1] = counts
+
+        # The lines replaced are edited, those after them moved
+        delta = new_lines - (last - first + 1)
+        self._dirty_lines = set(
+            line if line < first else line + delta
+            for line in self._dirty_lines
+            if line < first or line > last
+        )
+        self._dirty_lines.update(range(first, first + new_lines))
+
+    def on_insert_text(self, _buffer, location, text, _length):
+        # The location now points to the end of the inserted text
+        last_line = location.get_line()
+        first_line = last_line - text.count("\n")
+        self._replace_lines(first_line, first_line, last_line - first_line + 1)
+
+    def on_before_delete_range(self, _buffer, start, end):
+        self._deleted_lines = (start.get_line(), end.get_line())
+
+    def on_delete_range(self, _buffer, _start, _end):
+        first_line, last_line = self._deleted_lines
+        self._replace_lines(first_line, last_line, 1)
+
+
+def get_line_slice(buffer: Gtk.TextBuffer, line: int) -> tuple:
+    """Return the offset of the start of a line and its text, embedded
+    objects included to keep the offsets aligned."""
+    _found, start = buffer.get_iter_at_line(line)
+    end = start.copy()
+    if not end.ends_line():
+        end.forward_to_line_end()
+    return start.get_offset(), buffer.get_slice(start, end, True)
+
+
+def buffer_to_html(buffer: Gtk.TextBuffer):
+    """
+    Turn the content of a TextBuffer content with tags into a HTML payload
+    """
+    text, segments = get_formatted_text(buffer)
+    return text_to_html(text, segments)
+
+
+def get_formatted_text(buffer: Gtk.TextBuffer):
+    """
+    Return the text of the buffer and the formatting segments covering it
+    """
+    start_iter, end_iter = buffer.get_bounds()
+
+    # Use a slice to keep the offsets aligned with embedded objects
+    text = buffer.get_slice(start_iter, end_iter, True)
+
+    # Collect the formatting tags applied between two tag toggles
+    segments = []
+    iterator = start_iter
+    while not iterator.is_end():
+        tags = set(
+            tag.props.name for tag in iterator.get_tags()
+            if tag.props.name in FORMATTING_TAGS
+        )
+        iterator.forward_to_tag_toggle(None)
+        segments.append((iterator.get_offset(), tags))
+
+    return text, segments
+
+
+def has_tag_on_range(tag: Gtk.TextTag, start: Gtk.TextIter,
+                     end: Gtk.TextIter) -> bool:
+    """
+    Tell if the tag is applied to the whole range, using its toggles
+    """
+    if not start.has_tag(tag):
+        return False
+
+    # The tag is on at the start, the next toggle turns it off
+    iterator = start.copy()
+    iterator.forward_to_tag_toggle(tag)
+    return iterator.compare(end) >= 0
+
+
+def switch_tags_for_selection(text_buffer, tag_names):
+    """
+    Remove the tags if they all cover the selection, apply them otherwise
+    """
+    if not text_buffer.get_has_selection():
+        return
+    tag_table = text_buffer.get_tag_table()
+    tags = [tag_table.lookup(tag_name) for tag_name in tag_names]
+    start, end = text_buffer.get_selection_bounds()
+
+    full_tagged = all(has_tag_on_range(tag, start, end) for tag in tags)
+
+    # Changing tags invalidates the iterators, keep the offsets instead
+    start_offset, end_offset = start.get_offset(), end.get_offset()
+
+    # Make it a single step in the undo history
+    text_buffer.begin_user_action()
+    for tag in tags:
+        start = text_buffer.get_iter_at_offset(start_offset)
+        end = text_buffer.get_iter_at_offset(end_offset)
+        if full_tagged:
+            text_buffer.remove_tag(tag, start, end)
+        else:
+            text_buffer.apply_tag(tag, start, end)
+    text_buffer.end_user_action()
+
+
+def switch_tag_for_selection(text_buffer, tag_name):
+    switch_tags_for_selection(text_buffer, [tag_name])
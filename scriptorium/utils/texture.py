@@ -0,0 +1,154 @@
+# utils/texture.py
+#
+# Copyright 2025 Christophe Gueret
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Textures used to display the Image resources."""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from gi.repository import Gdk, GdkPixbuf, GLib
+from scriptorium.models import Image
+import weakref
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes of decoded pixels kept in memory for all the images
+TEXTURE_CACHE_BUDGET = 64 * 1024 * 1024
+
+# Requested sizes are rounded up to a power of two from this one, so that
+# close sizes share the same variant
+MIN_TEXTURE_SIZE = 64
+
+# The decoded textures, by path and size, least recently used first
+_textures = OrderedDict()
+_textures_size = 0
+
+# The callbacks waiting for a texture being decoded, by path and size
+_pending = {}
+
+# The image each picture is supposed to show, to ignore late textures
+_requested = weakref.WeakKeyDictionary()
+
+# Decoding happens in a few threads, only the textures are made on the main
+# thread
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="texture")
+
+
+def _round_size(size: int) -> int:
+    """Return the size of the variant used to display at a size."""
+    if size is None:
+        return None
+    rounded = MIN_TEXTURE_SIZE
+    while rounded < size:
+        rounded *= 2
+    return rounded
+
+
+def _decode(path: str, size: int) -> GdkPixbuf.Pixbuf:
+    """Load an image, scaled down to fit in a square of that size."""
+    _format, width, height = GdkPixbuf.Pixbuf.get_file_info(path)
+    if size is None or (width <= size and height <= size):
+        return GdkPixbuf.Pixbuf.new_from_file(path)
+    return GdkPixbuf.Pixbuf.new_from_file_at_scale(path, size, size, True)
+
+
+def _store(key: tuple, texture: Gdk.Texture):
+    """Keep a texture, dropping the least recently used ones if needed."""
+    global _textures_size
+    _textures[key] = texture
+    _textures_size += texture.get_width() * texture.get_height() * 4
+    while _textures_size > TEXTURE_CACHE_BUDGET and len(_textures) > 1:
+        _key, evicted = _textures.popitem(last=False)
+        _textures_size -= evicted.get_width() * evicted.get_height() * 4
+
+
+def _on_decoded(key: tuple, future):
+    """Turn a decoded image into a texture and hand it to the callbacks."""
+    callbacks = _pending.pop(key, [])
+    try:
+        texture = Gdk.Texture.new_for_pixbuf(future.result())
+    except GLib.GError as e:
+        logger.error(f"Could not load {key[0]}: {e}")
+        texture = None
+
+    if texture is not None:
+        _store(key, texture)
+    for callback in callbacks:
+        callback(texture)
+
+    # Don't repeat that callback
+    return False
+
+
+def load_texture(image: Image, size: int, callback) -> Gdk.Texture:
+    """
+    Return the texture of the image to display at a size, in pixels, or
+    None if it is not decoded yet. In that case the callback is given the
+    texture once it is. A size of None requests the full resolution.
+    """
+    if image.path is None:
+        return None
+
+    key = (str(image.path), _round_size(size))
+    texture = _textures.get(key)
+    if texture is not None:
+        _textures.move_to_end(key)
+        return texture
+
+    # Decode it only once however many are waiting for it
+    if key in _pending:
+        _pending[key].append(callback)
+    else:
+        _pending[key] = [callback]
+        future = _executor.submit(_decode, *key)
+        future.add_done_callback(
+            lambda future: GLib.idle_add(_on_decoded, key, future)
+        )
+    return None
+
+
+def set_picture_image(picture, image: Image, size: int = None):
+    """
+    Show an image in a picture at a size, in pixels, with a placeholder
+    until it is decoded.
+    """
+    if image is None:
+        _requested.pop(picture, None)
+        picture.set_paintable(None)
+        return
+
+    # Account for screens with several pixels per logical pixel, only the
+    # texture is decoded at that size
+    logical_size = size or 0
+    if size is not None:
+        size *= picture.get_scale_factor()
+    _requested[picture] = image
+
+    def on_texture(texture):
+        # The picture may have been given another image since
+        if _requested.get(picture) is image and texture is not None:
+            picture.set_paintable(texture)
+
+    texture = load_texture(image, size, on_texture)
+    if texture is None:
+        picture.set_paintable(
+            Gdk.Paintable.new_empty(logical_size, logical_size)
+        )
+    else:
+        picture.set_paintable(texture)
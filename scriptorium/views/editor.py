@@ -127,6 +127,7 @@ class ScrptEditorView(Adw.NavigationPage):
         """Handle a request to close the editor."""
         if self.project is not None:
             logger.info("Editor is closed, saving the manuscript")
+            self.write_page.save()
             self.project.save_to_disk()
 
     def close_on_delete(self):
@@ -200,8 +201,14 @@ class ScrptEditorView(Adw.NavigationPage):
                 file_name = info.get_name()
 
                 # Create the resource and set the content
+                # Scale it down if the user asked for it
+                settings = Gio.Settings(
+                    schema_id="io.github.cgueret.Scriptorium"
+                )
+                max_size = settings.get_int("image-import-max-size")
+
                 resource = self.project.create_resource(Image, file_name)
-                resource.set_content_from_path(file_path)
+                resource.set_content_from_path(file_path, max_size)
 
                 logger.info(f"Loaded image as {resource.identifier}")
                 action_callback(resource.identifier)
@@ -82,6 +82,11 @@ class ScrptLibraryView(Adw.NavigationPage):
         action.connect("activate", self.on_delete_project)
         group.add_action(action)
 
+        # Create the action to migrate all the projects at once
+        action = Gio.SimpleAction.new(name="migrate_all", parameter_type=None)
+        action.connect("activate", self.on_migrate_all)
+        group.add_action(action)
+
         # Signal to the list model to detect when content is available
         self.library.projects.connect(
             "items-changed",
@@ -222,6 +227,78 @@ class ScrptLibraryView(Adw.NavigationPage):
             # Nevermind then
             selection_model.set_selected(Gtk.INVALID_LIST_POSITION)
 
+    def on_migrate_all(self, _action, _parameter):
+        """Migrate every project of the library which needs it."""
+
+        projects = self.library.projects_to_migrate
+        if len(projects) == 0:
+            self.props.root.inform("All the projects are up to date")
+            return
+
+        # The dialog shows the progress and then a report for every project
+        progress_bar = Gtk.ProgressBar(show_text=True)
+        progress_bar.set_text(f"0 / {len(projects)}")
+        report = Gtk.ListBox(selection_mode=Gtk.SelectionMode.NONE)
+        report.add_css_class("boxed-list")
+        scrolled_window = Gtk.ScrolledWindow(
+            child=report,
+            propagate_natural_height=True,
+            max_content_height=300
+        )
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
+        box.append(progress_bar)
+        box.append(scrolled_window)
+
+        dialog = Adw.AlertDialog(
+            heading="Migrate Projects",
+            body=f"Migrating {len(projects)} projects. A snapshot of each project is taken first so it can be rolled back.",
+            close_response="close",
+            extra_child=box,
+        )
+        dialog.add_response("close", "Close")
+        dialog.set_response_enabled("close", False)
+
+        def on_progress(result, done, total):
+            progress_bar.set_fraction(done / total)
+            progress_bar.set_text(f"{done} / {total}")
+            report.append(self._build_migration_report_row(result))
+
+        def on_done(results):
+            failed = len([r for r in results if not r.worked])
+            dialog.set_body(
+                f"{len(results) - failed} projects migrated, {failed} failed."
+            )
+            dialog.set_response_enabled("close", True)
+
+        dialog.present(self)
+        self.library.migrate_projects(projects, on_progress, on_done)
+
+    def _build_migration_report_row(self, result):
+        """Create the row reporting on the migration of one project."""
+        project = result.project
+        row = Adw.ActionRow(title=project.title, subtitle=project.identifier)
+        if not result.worked:
+            row.set_subtitle(result.error or "Something went wrong")
+            row.add_prefix(Gtk.Image(icon_name="dialog-error-symbolic"))
+            return row
+
+        row.add_prefix(Gtk.Image(icon_name="emblem-ok-symbolic"))
+
+        # Offer to go back to the state saved before the migration
+        button = Gtk.Button(label="Roll Back", valign=Gtk.Align.CENTER)
+
+        def on_rollback_clicked(button):
+            if project.rollback_migration(result.snapshot):
+                row.set_subtitle("Rolled back")
+            else:
+                row.set_subtitle("Could not roll back, see logs for details")
+            button.set_sensitive(False)
+
+        button.connect("clicked", on_rollback_clicked)
+        row.add_suffix(button)
+
+        return row
+
     def on_delete_project(self, _action, parameter):
         """Delete a project from the library."""
 
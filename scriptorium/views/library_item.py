@@ -20,11 +20,15 @@ from gi.repository import Gtk
 from gi.repository import GObject
 from gi.repository import Gio
 from scriptorium.globals import BASE
+from scriptorium.utils.texture import set_picture_image
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Height of the covers in the library
+COVER_SIZE = 160
+
 
 @Gtk.Template(resource_path=f"{BASE}/views/library_item.ui")
 class LibraryItem(Gtk.Box):
@@ -82,10 +86,10 @@ class LibraryItem(Gtk.Box):
             # Finally see if we have a cover to show
             cover_image = self._project.manuscript.cover
             if cover_image is not None:
-                self.cover_picture.set_paintable(cover_image.texture)
+                set_picture_image(self.cover_picture, cover_image, COVER_SIZE)
                 self.stack.set_visible_child_name("cover")
             else:
-                self.cover_picture.set_paintable(None)
+                set_picture_image(self.cover_picture, None)
                 self.stack.set_visible_child_name("ok")
 
         # Create and associate to the button a specific menu for this project
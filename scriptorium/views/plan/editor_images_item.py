@@ -19,6 +19,7 @@
 
 from gi.repository import Adw, Gtk
 from scriptorium.globals import BASE
+from scriptorium.utils.texture import set_picture_image
 
 import logging
 
@@ -27,6 +28,9 @@ logger = logging.getLogger(__name__)
 
 ANIMATION_DURATION = 100
 
+# Size of the pictures in the grid of images
+THUMBNAIL_SIZE = 100
+
 
 def animate_opacity(widget, from_value, to_value):
     animation_target = Adw.PropertyAnimationTarget.new(
@@ -50,8 +54,8 @@ class ImageItem(Gtk.Overlay):
     def __init__(self, image):
         super().__init__()
 
-        # Add the picture
-        self.picture.set_paintable(image.texture)
+        # Add the picture, decoded at the size of the grid
+        set_picture_image(self.picture, image, THUMBNAIL_SIZE)
 
         # Connect to action to delete the image
         self.remove_image_button.set_detailed_action_name(
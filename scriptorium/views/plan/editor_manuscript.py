@@ -23,10 +23,14 @@ import logging
 from gi.repository import Adw, Gtk, GObject, Gio
 
 from scriptorium.globals import BASE
+from scriptorium.utils.texture import set_picture_image
 
 
 logger = logging.getLogger(__name__)
 
+# Size at which the cover is shown
+COVER_SIZE = 512
+
 
 @Gtk.Template(resource_path=f"{BASE}/views/plan/editor_manuscript.ui")
 class ScrptManuscriptPanel(Adw.NavigationPage):
@@ -111,9 +115,9 @@ class ScrptManuscriptPanel(Adw.NavigationPage):
         logger.info(f"Update cover to {cover_image}")
 
         if cover_image is not None:
-            self.cover_picture.set_paintable(cover_image.texture)
+            set_picture_image(self.cover_picture, cover_image, COVER_SIZE)
             self.cover_stack.set_visible_child_name("image_set")
         else:
-            self.cover_picture.set_paintable(None)
+            set_picture_image(self.cover_picture, None)
             self.cover_stack.set_visible_child_name("no_image_set")
 
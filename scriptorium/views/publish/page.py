@@ -20,7 +20,7 @@
 import logging
 from gi.repository import Adw, Gtk, Gio, GLib
 from scriptorium.globals import BASE
-from scriptorium.utils.publisher import Publisher
+from scriptorium.utils.publisher import Publisher, load_style
 from pathlib import Path
 
 try:
@@ -57,6 +57,9 @@ class PublishPage(Adw.Bin):
 
     web_view_placeholder = Gtk.Template.Child()
     toc = Gtk.Template.Child()
+    build_progress_box = Gtk.Template.Child()
+    build_progress = Gtk.Template.Child()
+    publish_button = Gtk.Template.Child()
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -88,6 +91,9 @@ class PublishPage(Adw.Bin):
              self.on_selected_item
         )
 
+        # Instantiated while the book is being built
+        self._cancellable = None
+
     def connect_to_project(self, project):
         logger.info("Project changed")
         self._project = project
@@ -99,11 +105,47 @@ class PublishPage(Adw.Bin):
         self.reload_book()
 
     def reload_book(self):
+        # Wait for the build in progress to be done
+        if self._cancellable is not None:
+            return
+
+        # The parts which changed are rendered in the background
+        self._cancellable = Gio.Cancellable()
+        self.publish_button.set_sensitive(False)
+        self._publisher.rebuild_async(
+            self.on_build_progress, self.on_build_done, self._cancellable
+        )
+
+    def on_build_progress(self, done, total):
+        self.build_progress_box.set_visible(True)
+        self.build_progress.set_fraction(done / total)
+        self.build_progress.set_text(f"{done} / {total}")
+        return False
+
+    @Gtk.Template.Callback()
+    def on_cancel_build_clicked(self, _button):
+        if self._cancellable is not None:
+            self._cancellable.cancel()
+
+    def on_build_done(self, changed):
+        self._cancellable = None
+        self.build_progress_box.set_visible(False)
+        self.publish_button.set_sensitive(True)
+
+        # Nothing to do if cancelled or if the manuscript did not change
+        if changed is None:
+            return False
+        if not changed and self.toc.get_row_at_index(0):
+            return False
+
+        self.refresh_table_of_contents()
+        return False
+
+    def refresh_table_of_contents(self):
         # Remove all the previous content
         self.toc.remove_all()
 
         # Load the new ToC
-        self._publisher.rebuild()
         book_parts = self._publisher.table_of_contents
         for book_part in book_parts:
             widget = NavigationRow(book_part)
@@ -127,9 +169,7 @@ class PublishPage(Adw.Bin):
             content = content.decode()
 
         # Save the CSS to disk to be able to load it
-        style = Gio.File.new_for_uri(
-            f"resource:/{BASE}/utils/epub-novel.css"
-        ).load_contents()[1].decode()
+        style = load_style()
         directory = Path(GLib.get_user_data_dir()) / Path('style')
         directory.mkdir(exist_ok=True)
         (directory / Path('novel.css')).write_text(style)
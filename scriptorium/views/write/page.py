@@ -19,8 +19,13 @@
 from gi.repository import Adw, Gtk, Gdk, GLib, Gio, GObject
 from scriptorium.globals import BASE
 from scriptorium.widgets import AnnotationCard
-from scriptorium.models import Scene
-from scriptorium.utils import switch_tag_for_selection
+from scriptorium.models import Scene, Annotation, AnnotationList
+from scriptorium.language_tool import ParagraphChecker
+from scriptorium.utils import text_to_html
+from scriptorium.utils.text_buffer import (
+    get_formatted_text, get_line_slice, switch_tag_for_selection
+)
+from .scene_buffer import SceneBufferCache, ScenePrefetcher
 
 import logging
 import threading
@@ -32,6 +37,9 @@ logger = logging.getLogger(__name__)
 # Mutex to avoid having to matches callback edit the buffer at the same time
 text_buffer_lock = threading.Lock()
 
+# Seconds between two snapshots of a scene kept in the recovery journal
+JOURNAL_SNAPSHOT_PERIOD = 15
+
 
 @Gtk.Template(resource_path=f"{BASE}/views/write/page.ui")
 class WritePage(Adw.Bin):
@@ -41,6 +49,7 @@ class WritePage(Adw.Bin):
     label_words = Gtk.Template.Child()
     css_provider = Gtk.CssProvider()
     annotations_list = Gtk.Template.Child()
+    annotations_stack = Gtk.Template.Child()
     show_annotations = Gtk.Template.Child()
 
     navigation = Gtk.Template.Child()
@@ -59,10 +68,33 @@ class WritePage(Adw.Bin):
         # Instantiated with a timeout to detect when the editor is idle
         self._idle_timeout_id = None
 
-        # Instantiated with a list of annotations from the spellchecker
-        self._annotations = None
+        # Instantiated with a timeout to snapshot the edited scenes
+        self._journal_timeout_id = None
+
+        # The buffers of the scenes recently opened, all sharing the tags
+        # created by the text view
+        self._empty_buffer = self.text_view.get_buffer()
+        self._buffers = SceneBufferCache(
+            self._empty_buffer.get_tag_table(), self.on_scene_deleted
+        )
+
+        # The buffer of the active scene
+        self._active = None
+
+        # The scenes we listen to for the outcome of saves
+        self._watched_scenes = set()
 
-        self.text_view.get_buffer().connect("changed", self.on_buffer_changed)
+        # Get the scenes around the active one ready to be loaded
+        self._prefetcher = ScenePrefetcher()
+
+        # The annotations shown in the sidebar
+        self._annotations_model = AnnotationList()
+        self._annotations_model.connect(
+            "items-changed", self.on_annotations_model_changed
+        )
+        self.annotations_list.set_model(
+            Gtk.NoSelection(model=self._annotations_model)
+        )
 
         # Create all the actions
         action_group = Gio.SimpleActionGroup()
@@ -107,6 +139,50 @@ class WritePage(Adw.Bin):
         navigation_model = self.navigation.list_view.get_model()
         navigation_model.connect("selection-changed", self.on_selection_changed)
 
+        # Check if edits were lost the last time the project was opened
+        GLib.idle_add(self.offer_recovery)
+
+    def offer_recovery(self):
+        """Offer to save the scenes recorded in the journal, if any."""
+        journal = self.project.journal
+        recoverable = []
+        for identifier, snapshot in journal.recoverable().items():
+            scene = self.project.get_resource(identifier)
+            if scene is None or text_to_html(*snapshot) == scene.to_html():
+                continue
+            recoverable.append((scene, snapshot))
+
+        if len(recoverable) == 0:
+            journal.clear()
+            return False
+
+        titles = ", ".join(f'"{scene.title}"' for scene, _ in recoverable)
+        dialog = Adw.AlertDialog(
+            heading="Recover Unsaved Changes",
+            body=f"Some changes to {titles} were not saved when the project was last closed. Do you want to recover them?",
+            close_response="discard",
+        )
+        dialog.add_response("discard", "Discard")
+        dialog.add_response("recover", "Recover")
+        dialog.set_response_appearance(
+            "recover", Adw.ResponseAppearance.SUGGESTED
+        )
+
+        def handle_response(dialog, task):
+            if dialog.choose_finish(task) == "recover":
+                # The journal is updated as each of them gets saved
+                for scene, (text, segments) in recoverable:
+                    logger.info(f"{scene.title}: Recovering from the journal")
+                    self._watch_scene(scene)
+                    scene.save_in_background(text, segments)
+            else:
+                journal.clear()
+
+        dialog.choose(self, None, handle_response)
+
+        # Don't repeat that callback
+        return False
+
     def unselect_on_delete(self, _src):
         """Handle case when a selected resource is deleted."""
         logger.info("Unselect on delete")
@@ -127,39 +203,18 @@ class WritePage(Adw.Bin):
             logger.info(f"Selected scene {scene.title}")
             self.load_scene(scene)
             self.stack.set_visible_child_name("editor")
-            scene.connect("deleted", self.unselect_on_delete)
         else:
             logger.info("Nothing selected")
             self.stack.set_visible_child_name("select_scene")
 
     def load_scene(self, scene: Scene):
-        """Load a new scene into the text editor."""
-        # Get the text buffer of the editor
-        buffer = self.text_view.get_buffer()
-
-        # If there is a scene loaded save the content and clear it
-        if self.active_scene is not None:
-            # Remove all the language check annotations
-            self.clear_annotations()
-
-            # Clear the annotations list box too
-            self.annotations_list.remove_all()
-
-            # Save the content of the buffer
-            self.active_scene.save_from_buffer(buffer)
-
-            # Clear the content of the text buffer
-            buffer.begin_irreversible_action()
-            start_iter, end_iter = buffer.get_bounds()
-            buffer.delete(start_iter, end_iter)
-            buffer.end_irreversible_action()
-
-            # Unbind
-            self.edit_title_binding.unbind()
-            self.edit_synopsis_binding.unbind()
+        """Switch the text editor to the buffer of a scene."""
+        if self._active is not None and self._active.scene is scene:
+            return
 
-        # Load the scene into the buffer
-        scene.load_into_buffer(buffer)
+        # If there is a scene loaded save the content and put it aside
+        if self._active is not None:
+            self._deactivate()
 
         # Connect the information bar properties to the scene
         self.edit_title_binding = scene.bind_property(
@@ -175,8 +230,105 @@ class WritePage(Adw.Bin):
             GObject.BindingFlags.BIDIRECTIONAL | GObject.BindingFlags.SYNC_CREATE,
         )
 
-        # Set the scene as active
+        # Saves happen in the background, listen for how they went
+        self._watch_scene(scene)
+
+        # Set the scene as active, this may evict and save an older buffer
         self.active_scene = scene
+        self._active = self._buffers.get(scene)
+        self._active_changed_id = self._active.buffer.connect(
+            "changed", self.on_buffer_changed
+        )
+        self.text_view.set_buffer(self._active.buffer)
+
+        # Catch up with the annotations setting and list
+        if self._active.annotations_shown != self.show_annotations.get_active():
+            self.refresh_annotations_tags()
+        self.update_annotations_model()
+
+        # Load the scene into the buffer if needed, edits are disabled until
+        # it is done. A buffer already loaded is used as it is.
+        if self._active.loader is None:
+            self.text_view.set_editable(False)
+            self._active.load(
+                self.on_scene_loaded, self._prefetcher.take(scene)
+            )
+        elif self._active.is_loading:
+            self.text_view.set_editable(False)
+        else:
+            self.text_view.set_editable(True)
+            self.on_buffer_changed(self._active.buffer)
+
+        # The next scene to open is likely one of its neighbours
+        neighbours = self.project.manuscript.get_neighbours(scene)
+        self._prefetcher.prefetch([
+            neighbour for neighbour in neighbours
+            if neighbour is not None and neighbour not in self._buffers
+        ])
+
+    def _deactivate(self, save: bool = True):
+        """Put the buffer of the active scene aside, saving it if edited."""
+        if self._idle_timeout_id is not None:
+            GLib.source_remove(self._idle_timeout_id)
+            self._idle_timeout_id = None
+
+        self._active.buffer.disconnect(self._active_changed_id)
+        if save:
+            self._active.save()
+        self._active = None
+        self.active_scene = None
+        self.text_view.set_buffer(self._empty_buffer)
+
+        # Clear the annotations list
+        self._annotations_model.remove_all()
+
+        # Unbind
+        self.edit_title_binding.unbind()
+        self.edit_synopsis_binding.unbind()
+
+    def save(self):
+        """Save all the scenes edited, and release their buffers."""
+        # The active buffer is saved along with the others, in one batch
+        if self._active is not None:
+            self._deactivate(save=False)
+        self._buffers.clear()
+        self._prefetcher.clear()
+        self.project.journal.flush()
+
+    def on_scene_loaded(self, scene_buffer):
+        """Enable edits and run the checks once the scene is fully loaded."""
+        logger.info(f"{scene_buffer.scene.title}: Loaded into buffer")
+        if scene_buffer is self._active:
+            self.text_view.set_editable(True)
+            self.on_buffer_changed(scene_buffer.buffer)
+
+    def _watch_scene(self, scene: Scene):
+        if scene.identifier not in self._watched_scenes:
+            scene.connect("saved", self.on_saved)
+            scene.connect("save-failed", self.on_save_failed)
+            self._watched_scenes.add(scene.identifier)
+
+    def on_saved(self, scene):
+        """Clear the journal of a scene, unless it was edited since."""
+        scene_buffer = self._buffers.peek(scene)
+        if scene_buffer is None or not scene_buffer.buffer.get_modified():
+            self.project.journal.mark_saved(scene.identifier)
+
+    def on_save_failed(self, scene, error):
+        """Let the user know and keep the edits to save them again."""
+        scene_buffer = self._buffers.peek(scene)
+        if scene_buffer is not None:
+            scene_buffer.buffer.set_modified(True)
+
+        window = self.props.root
+        if window is not None:
+            window.inform(f'Could not save "{scene.title}": {error}')
+
+    def on_scene_deleted(self, scene_buffer):
+        """Drop the buffer of a deleted scene and unselect it."""
+        if scene_buffer is self._active:
+            self._deactivate(save=False)
+        self.unselect_on_delete(scene_buffer.scene)
 
     def on_text_view_click(self, _gesture, n_press, x, y):
         # If we are on a suggestion, automatically select it.
@@ -193,106 +345,229 @@ class WritePage(Adw.Bin):
             found, click_iter = self.text_view.get_iter_at_location(
                 buff_x, buff_y
             )
-            if found and self._annotations is not None:
-                offset = click_iter.get_offset()
+            match = None
+            if found and self._active is not None:
+                match = self._active.annotations.at(click_iter.get_offset())
+            if match is not None:
                 location = self.text_view.get_iter_location(click_iter)
                 iter_x, iter_y = self.text_view.buffer_to_window_coords(
                     Gtk.TextWindowType.TEXT, location.x, location.y
                 )
-                for match in self._annotations:
-                    if match.offset < offset < match.offset + match.length:
-                        self.text_view.move_overlay(
-                            child=self.anchor_overlay,
-                            xpos=iter_x,
-                            ypos=iter_y+(location.height / 2)+3
-                        )
-                        self.popover_annotation.set_pointing_to(
-                            Gdk.Rectangle(
-                                x=iter_x,
-                                y=iter_y,
-                                width=1,
-                                height=location.height
-                            )
-                        )
-                        self.popover_annotation.set_child(
-                            AnnotationCard(self.text_view.get_buffer(), match)
-                        )
-                        self.popover_annotation.popup()
+                self.text_view.move_overlay(
+                    child=self.anchor_overlay,
+                    xpos=iter_x,
+                    ypos=iter_y+(location.height / 2)+3
+                )
+                self.popover_annotation.set_pointing_to(
+                    Gdk.Rectangle(
+                        x=iter_x,
+                        y=iter_y,
+                        width=1,
+                        height=location.height
+                    )
+                )
+                self.popover_annotation.set_child(
+                    AnnotationCard(self.text_view, Annotation(match))
+                )
+                self.popover_annotation.popup()
 
     @Gtk.Template.Callback()
     def do_toggle_bold(self, _src, _param = None):
-        switch_tag_for_selection(self.text_view.get_buffer(), "strong")
+        if self.text_view.get_editable():
+            switch_tag_for_selection(self.text_view.get_buffer(), "strong")
 
     @Gtk.Template.Callback()
     def do_toggle_italics(self, _src, _param = None):
-        switch_tag_for_selection(self.text_view.get_buffer(), "em")
+        if self.text_view.get_editable():
+            switch_tag_for_selection(self.text_view.get_buffer(), "em")
+
+    def on_received_annotations(self, scene_buffer, paragraphs, annotations):
+        # The text may have changed while the paragraphs were checked, only
+        # use the results of those still in place
+        buffer = scene_buffer.buffer
+        ranges = []
+        for offset, paragraph in paragraphs:
+            iterator = buffer.get_iter_at_offset(offset)
+            if not iterator.starts_line():
+                continue
+            if get_line_slice(buffer, iterator.get_line())[1] == paragraph:
+                ranges.append((offset, offset + len(paragraph)))
+
+        # Those which moved without being edited have to be checked again
+        if len(ranges) < len(paragraphs):
+            scene_buffer.word_counter.mark_all_dirty()
+            if scene_buffer is self._active and self._idle_timeout_id is None:
+                self._idle_timeout_id = GLib.timeout_add(
+                    200, self.on_editor_idle
+                )
 
-    def on_received_annotations(self, annotations):
-        # If there is another check queued forget that one
-        if self._idle_timeout_id is not None:
-            return
+        # Only update the tags of the annotations which changed
+        added, removed = scene_buffer.annotations.update_ranges(
+            ranges, annotations
+        )
+        if scene_buffer.annotations_shown:
+            self.update_annotations_tags(scene_buffer, added, removed)
+
+        # And the cards for those in the sidebar
+        if scene_buffer is self._active:
+            self.update_annotations_model()
+
+    def update_annotations_model(self):
+        """Splice in the sidebar only the annotations which changed."""
+        model = self._annotations_model
+        old = list(model)
+        new = list(self._active.annotations)
+
+        # Both lists are sorted by offset, find what they have in common
+        start = 0
+        while start < min(len(old), len(new)) and old[start] is new[start]:
+            start += 1
+        end = 0
+        while (
+            end < min(len(old), len(new)) - start
+            and old[len(old) - end - 1] is new[len(new) - end - 1]
+        ):
+            end += 1
+
+        if start + end < len(old) or start + end < len(new):
+            model.splice(
+                start, len(old) - start - end, new[start:len(new) - end]
+            )
 
-        self._annotations = annotations
-        self.refresh_annotations_tags()
+    def on_annotations_model_changed(self, model, _position, _removed, _added):
+        if model.get_n_items() > 0:
+            self.annotations_stack.set_visible_child_name("annotations")
+        else:
+            self.annotations_stack.set_visible_child_name("empty")
 
-        # Clear the list box
-        self.annotations_list.remove_all()
+    @Gtk.Template.Callback()
+    def on_annotation_setup(self, _factory, list_item):
+        list_item.set_activatable(False)
+        list_item.set_selectable(False)
+        list_item.set_child(AnnotationCard(self.text_view))
 
-        # Then add the new card
-        for annotation in annotations:
-            card = AnnotationCard(self.text_view.get_buffer(), annotation)
-            self.annotations_list.append(card)
+    @Gtk.Template.Callback()
+    def on_annotation_bind(self, _factory, list_item):
+        list_item.get_child().bind(list_item.get_item())
 
     def on_editor_idle(self):
         self._idle_timeout_id = None
-
-        text_buffer = self.text_view.get_buffer()
-        start_iter, end_iter = text_buffer.get_bounds()
-        content = text_buffer.get_text(start_iter, end_iter, False)
+        scene_buffer = self._active
+        text_buffer = scene_buffer.buffer
+        word_counter = scene_buffer.word_counter
 
         # Update the number of words
-        words = len(content.split())
-        self.label_words.set_label(str(words))
+        self.label_words.set_label(str(word_counter.total))
 
         # Call LanguageTool
         window = self.props.root
         application = window.props.application
         language_tool = application.language_tool
 
-        # If language tool is not ready try again later
+        # Only the paragraphs of the lines edited since the last check are
+        # given, the others keep their annotations
+        paragraphs = []
+        lines = {}
+        for line in word_counter.take_dirty_lines():
+            offset, paragraph = get_line_slice(text_buffer, line)
+            if paragraph.strip() != "":
+                paragraphs.append((offset, paragraph))
+                lines[offset] = line
+
+        # Show what is already known, the server is only queried if needed
+        if scene_buffer.checker is None:
+            scene_buffer.checker = ParagraphChecker(language_tool, "en-GB")
+        unchecked = []
+        if len(paragraphs) > 0:
+            unchecked = scene_buffer.checker.check(
+                paragraphs,
+                lambda paragraphs, annotations: self.on_received_annotations(
+                    scene_buffer, paragraphs, annotations
+                )
+            )
+
+        # If language tool is not ready, check the others once it is
+        if len(unchecked) > 0:
+            word_counter.mark_dirty(lines[offset] for offset, _p in unchecked)
+            self._idle_timeout_id = GLib.timeout_add(
+                200, self.on_waiting_for_server
+            )
+
+        # Don't repeat that callback
+        return False
+
+    def on_waiting_for_server(self):
+        """Check the paragraphs left aside once the server is up."""
+        language_tool = self.props.root.props.application.language_tool
         if not language_tool.server_is_alive:
-            self._idle_timeout_id = GLib.timeout_add(200, self.on_editor_idle)
-        else:
-            language_tool.check(content, "en-GB", self.on_received_annotations)
+            return True
+        self._idle_timeout_id = None
+        self.on_editor_idle()
+        return False
+
+    def on_journal_timeout(self):
+        """Snapshot the scenes edited since their last snapshot."""
+        self._journal_timeout_id = None
+        for scene_buffer in self._buffers:
+            if (scene_buffer.is_loading
+                    or not scene_buffer.buffer.get_modified()
+                    or scene_buffer.edits == scene_buffer.journaled_edits):
+                continue
+            scene_buffer.journaled_edits = scene_buffer.edits
+            self.project.journal.record(
+                scene_buffer.scene.identifier,
+                *get_formatted_text(scene_buffer.buffer)
+            )
 
         # Don't repeat that callback
         return False
 
-    def clear_annotations(self):
+    def clear_annotations(self, text_buffer):
         """Remove all the current annotations on the text."""
-        text_buffer = self.text_view.get_buffer()
         start_iter, end_iter = text_buffer.get_bounds()
         text_buffer.remove_tag_by_name("error", start_iter, end_iter)
         text_buffer.remove_tag_by_name("warning", start_iter, end_iter)
         text_buffer.remove_tag_by_name("hint", start_iter, end_iter)
 
+    def _apply_annotation_tag(self, buffer, annotation):
+        start_iter = buffer.get_iter_at_offset(annotation.offset)
+        end_iter = buffer.get_iter_at_offset(
+            annotation.offset + annotation.length
+        )
+        buffer.apply_tag_by_name(annotation.category, start_iter, end_iter)
+
     def refresh_annotations_tags(self):
+        if self._active is None:
+            return
+        buffer = self._active.buffer
+
         # Start by removing all previous annotations
-        self.clear_annotations()
+        self.clear_annotations(buffer)
 
         # Then add the new ones
-        if self.show_annotations.get_active() and self._annotations:
-            buffer = self.text_view.get_buffer()
-            for annotation in self._annotations:
-                start_iter = buffer.get_iter_at_offset(
-                    annotation.offset
-                )
-                end_iter = buffer.get_iter_at_offset(
-                    annotation.offset + annotation.length
-                )
-                buffer.apply_tag_by_name(
-                    annotation.category, start_iter, end_iter
-                )
+        self._active.annotations_shown = self.show_annotations.get_active()
+        if self._active.annotations_shown:
+            for annotation in self._active.annotations:
+                self._apply_annotation_tag(buffer, annotation)
+
+    def update_annotations_tags(self, scene_buffer, added, removed):
+        """Update the tags for the annotations added and removed."""
+        buffer = scene_buffer.buffer
+        for annotation in removed:
+            start_iter = buffer.get_iter_at_offset(annotation.offset)
+            end_iter = buffer.get_iter_at_offset(
+                annotation.offset + annotation.length
+            )
+            buffer.remove_tag_by_name(annotation.category, start_iter, end_iter)
+
+            # Restore the tags of annotations sharing that range
+            for other in scene_buffer.annotations.overlapping(
+                annotation.offset, annotation.offset + annotation.length
+            ):
+                self._apply_annotation_tag(buffer, other)
+
+        for annotation in added:
+            self._apply_annotation_tag(buffer, annotation)
 
     @Gtk.Template.Callback()
     def on_show_annotations_toggled(self, _toggle_button):
@@ -301,6 +576,28 @@ class WritePage(Adw.Bin):
     def on_buffer_changed(self, text_buffer):
         """Keep an eye on modifications of the buffer."""
         self.popover_annotation.popdown()
+
+        # Tags can't be changed while the text is, so we do it now
+        scene_buffer = self._active
+        if len(scene_buffer.dropped_annotations) > 0:
+            dropped = scene_buffer.dropped_annotations
+            scene_buffer.dropped_annotations = []
+            if scene_buffer.annotations_shown:
+                self.update_annotations_tags(scene_buffer, [], dropped)
+            self.update_annotations_model()
+
+        # Wait for the scene to be fully loaded before checking anything
+        if scene_buffer.is_loading:
+            return
+        scene_buffer.edits += 1
+
+        # Keep a copy of the edits until they get saved, at most once per
+        # period as taking it goes through the whole scene
+        if self._journal_timeout_id is None:
+            self._journal_timeout_id = GLib.timeout_add_seconds(
+                JOURNAL_SNAPSHOT_PERIOD, self.on_journal_timeout
+            )
+
         if self._idle_timeout_id:
             GLib.source_remove(self._idle_timeout_id)
 
@@ -0,0 +1,253 @@
+# views/write/scene_buffer.py
+#
+# Copyright 2025 Christophe Gueret
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""The live text buffers of the scenes recently opened in the editor."""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from gi.repository import Gtk
+from scriptorium.models import AnnotationIndex
+from scriptorium.models.scene import save_scenes_in_background
+from scriptorium.utils import parse_html
+from scriptorium.utils.text_buffer import (
+    ProgressiveLoader, WordCounter, get_formatted_text
+)
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of scenes kept loaded in a buffer
+BUFFER_CACHE_SIZE = 5
+
+
+class SceneBuffer(object):
+    """
+    The text buffer of a scene and everything kept in sync with it
+    """
+
+    def __init__(self, scene, tag_table: Gtk.TextTagTable):
+        self.scene = scene
+        self.buffer = Gtk.TextBuffer(tag_table=tag_table)
+
+        # The annotations from the spellchecker, kept in sync with the text
+        self.annotations = AnnotationIndex()
+
+        # The annotations invalidated by an edit, to remove from the text
+        self.dropped_annotations = []
+
+        # Whether the tags of the annotations are applied to the text
+        self.annotations_shown = False
+
+        # Instantiated to check only the paragraphs which changed
+        self.checker = None
+
+        # Instantiated while the scene is being loaded into the buffer
+        self.loader = None
+
+        # Count of the edits of the text, and the count when the last
+        # snapshot was kept in the recovery journal
+        self.edits = 0
+        self.journaled_edits = 0
+
+        self.buffer.connect("insert-text", self.on_insert_text)
+        self.buffer.connect("delete-range", self.on_delete_range)
+
+        # Keep the number of words up to date as the text is edited
+        self.word_counter = WordCounter(self.buffer)
+
+        # Set by the cache to forget about the scene once deleted
+        self.deleted_handler_id = None
+
+    @property
+    def is_loading(self) -> bool:
+        return self.loader is not None and self.loader.is_loading
+
+    def load(self, on_done, parsed: tuple = None):
+        """Fill the buffer with the content of the scene, using the result
+        of parse_html() if the content was prefetched."""
+        logger.info(f"{self.scene.title}: Loading into buffer")
+
+        def on_loaded():
+            # Loading the content is not an edit
+            self.buffer.set_modified(False)
+            on_done(self)
+
+        self.loader = ProgressiveLoader(
+            self.buffer, self.scene.to_html(), on_loaded, parsed
+        )
+        self.loader.start()
+
+    def snapshot(self) -> tuple:
+        """Return what save_scenes_in_background needs to save the content
+        of the buffer, or None if it was not edited."""
+        if self.is_loading or not self.buffer.get_modified():
+            return None
+
+        text, segments = get_formatted_text(self.buffer)
+        self.buffer.set_modified(False)
+        return self.scene, text, segments
+
+    def save(self):
+        """Save the content of the buffer in the background, if edited."""
+        # Take a snapshot now, the rest is done in a thread
+        snapshot = self.snapshot()
+        if snapshot is not None:
+            save_scenes_in_background([snapshot])
+
+    def close(self):
+        """Stop loading the scene and release what is kept in sync."""
+        if self.loader is not None:
+            self.loader.cancel()
+        if self.checker is not None:
+            self.checker.close()
+        self.annotations.clear()
+
+    def on_insert_text(self, _buffer, location, text, _length):
+        """Shift the annotations placed after the inserted text."""
+        self.dropped_annotations += self.annotations.on_inserted(
+            location.get_offset(), len(text)
+        )
+
+    def on_delete_range(self, _buffer, start, end):
+        """Shift the annotations placed after the deleted text."""
+        self.dropped_annotations += self.annotations.on_deleted(
+            start.get_offset(), end.get_offset()
+        )
+
+
+class SceneBufferCache(object):
+    """
+    Keep the buffers of the scenes most recently opened, saving the others
+    """
+
+    def __init__(self, tag_table: Gtk.TextTagTable, on_deleted,
+                 max_size: int = BUFFER_CACHE_SIZE):
+        self._tag_table = tag_table
+        self._on_deleted = on_deleted
+        self._max_size = max_size
+
+        # Ordered from the least to the most recently used
+        self._entries = OrderedDict()
+
+    def __iter__(self):
+        return iter(list(self._entries.values()))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, scene):
+        return scene.identifier in self._entries
+
+    def peek(self, scene) -> SceneBuffer:
+        """Return the buffer of a scene if there is one, leaving the order
+        of the buffers as it is."""
+        return self._entries.get(scene.identifier)
+
+    def get(self, scene) -> SceneBuffer:
+        """Return the buffer of a scene, creating it if needed."""
+        entry = self._entries.get(scene.identifier)
+        if entry is not None:
+            self._entries.move_to_end(scene.identifier)
+            return entry
+
+        entry = SceneBuffer(scene, self._tag_table)
+        entry.deleted_handler_id = scene.connect(
+            "deleted", self.on_scene_deleted
+        )
+        self._entries[scene.identifier] = entry
+
+        # Make room by saving and closing the least recently used buffers
+        while len(self._entries) > self._max_size:
+            _identifier, evicted = self._entries.popitem(last=False)
+            logger.info(f"{evicted.scene.title}: Evicted from the buffers")
+            evicted.save()
+            self._release(evicted)
+
+        return entry
+
+    def save(self):
+        """Save all the buffers which have been edited, together."""
+        snapshots = [entry.snapshot() for entry in self._entries.values()]
+        save_scenes_in_background([s for s in snapshots if s is not None])
+
+    def clear(self):
+        """Save and close all the buffers."""
+        self.save()
+        for entry in self._entries.values():
+            self._release(entry)
+        self._entries.clear()
+
+    def _release(self, entry: SceneBuffer):
+        entry.scene.disconnect(entry.deleted_handler_id)
+        entry.close()
+
+    def on_scene_deleted(self, scene):
+        """Forget about the buffer of a deleted scene, without saving it."""
+        entry = self._entries.pop(scene.identifier, None)
+        if entry is not None:
+            self._release(entry)
+            self._on_deleted(entry)
+
+
+class ScenePrefetcher(object):
+    """
+    Read and parse the scenes around the active one, in a thread
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="prefetch"
+        )
+
+        # The pending or finished reads, by scene identifier
+        self._futures = {}
+
+    def prefetch(self, scenes):
+        """Get the content of the scenes ready, forgetting about others."""
+        futures = {}
+        for scene in scenes:
+            future = self._futures.pop(scene.identifier, None)
+            if future is None:
+                logger.debug(f"{scene.title}: Prefetching")
+                future = self._executor.submit(self._read, scene)
+            futures[scene.identifier] = future
+
+        for future in self._futures.values():
+            future.cancel()
+        self._futures = futures
+
+    def take(self, scene) -> tuple:
+        """Return the parsed content of the scene if it is ready."""
+        future = self._futures.pop(scene.identifier, None)
+        if future is None or not future.done() or future.exception():
+            return None
+
+        # The scene may have been saved since it was read
+        html_content, parsed = future.result()
+        if html_content != scene.to_html():
+            return None
+        return parsed
+
+    def clear(self):
+        """Forget about all the scenes, cancelling the pending reads."""
+        self.prefetch([])
+
+    def _read(self, scene):
+        html_content = scene.to_html()
+        return html_content, parse_html(html_content)
@@ -28,6 +28,10 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+CATEGORY_CSS_CLASSES = [
+    "annotation-warning", "annotation-error", "annotation-hint"
+]
+
 
 @Gtk.Template(resource_path=f"{BASE}/widgets/annotation.ui")
 class AnnotationCard(Adw.Bin):
@@ -39,8 +43,16 @@ class AnnotationCard(Adw.Bin):
     icon = Gtk.Template.Child()
     suggestions = Gtk.Template.Child()
 
-    def __init__(self, text_buffer, annotation: Annotation):
+    def __init__(self, text_view, annotation: Annotation = None):
         super().__init__()
+        # The view is kept rather than its buffer, which changes with scenes
+        self._text_view = text_view
+
+        if annotation is not None:
+            self.bind(annotation)
+
+    def bind(self, annotation: Annotation):
+        """Display an annotation, replacing the previous one if any."""
         self.annotation = annotation
 
         # Set basic attributes
@@ -48,6 +60,8 @@ class AnnotationCard(Adw.Bin):
         self.message = annotation.message
 
         # Adjust the color of the header according to the type of annotation
+        for css_class in CATEGORY_CSS_CLASSES:
+            self.icon.remove_css_class(css_class)
         if annotation.category == "warning":
             self.icon.add_css_class("annotation-warning")
             self.icon.set_from_icon_name("dialog-warning-symbolic")
@@ -59,13 +73,15 @@ class AnnotationCard(Adw.Bin):
             self.icon.set_from_icon_name("dialog-information-symbolic")
 
         # Add the suggestions (limit to top 10 if we have more)
+        self.suggestions.remove_all()
         for suggestion in annotation.suggestions[:10]:
-            button = Gtk.Button(label=suggestion.get_string())
+            button = Gtk.Button(label=suggestion)
             button.add_css_class("suggested-action")
-            button.connect("clicked", self.on_suggestion_click, text_buffer)
+            button.connect("clicked", self.on_suggestion_click)
             self.suggestions.append(button)
 
-    def on_suggestion_click(self, button, text_buffer):
+    def on_suggestion_click(self, button):
+        text_buffer = self._text_view.get_buffer()
         start_iter = text_buffer.get_iter_at_offset(self.annotation.offset)
         end_iter = text_buffer.get_iter_at_offset(
             self.annotation.offset + self.annotation.length
@@ -24,7 +24,7 @@ from pathlib import Path
 # It seems Builder won't find the widgets unless we import them?
 from scriptorium.views import ScrptEditorView
 
-from scriptorium.models import Project
+from scriptorium.models import Project, Scene
 from scriptorium.globals import BASE
 
 logger = logging.getLogger(__name__)
@@ -84,6 +84,15 @@ class ScrptWindow(Adw.ApplicationWindow):
             Gio.SettingsBindFlags.DEFAULT
         )
 
+        # Size the memory kept for the content of the scenes, now and
+        # whenever it is changed
+        self.settings.connect(
+            "changed::content-cache-budget", self.on_content_cache_budget_changed
+        )
+        self.on_content_cache_budget_changed(
+            self.settings, "content-cache-budget"
+        )
+
         # Create a property for last open project and connect that to a setting
         # Notify for changes here; check if correct version before pushing
         # if all fine push to editor
@@ -116,6 +125,9 @@ class ScrptWindow(Adw.ApplicationWindow):
         self.projects_base_path = projects_path.resolve()
 
     @Gtk.Template.Callback()
+    def on_content_cache_budget_changed(self, settings, key):
+        Scene.content_cache.budget = settings.get_int(key) * 1024 * 1024
+
     def on_close_request(self, event):
         logger.info("Window close requested")
         # Save the name of the last edited project
@@ -0,0 +1,101 @@
+# tests/test_html.py
+#
+# Copyright 2025 Christophe Gueret
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Round trips between formatted text and the HTML of scenes."""
+
+import random
+
+import pytest
+
+from scriptorium.utils import FORMATTING_TAGS, parse_html, text_to_html
+
+# Characters to write paragraphs with, some of them to be escaped
+ALPHABET = "ab <&>\"'é"
+
+
+def random_formatted_text(rng: random.Random):
+    """Return the text of a few paragraphs, laid out as in the editor, and
+    the formatting tags of every character."""
+    text = []
+    tags = []
+    for _ in range(rng.randint(1, 5)):
+        current = set()
+        for _ in range(rng.randint(1, 30)):
+            # Open or close a tag now and then, nesting them at random
+            if rng.random() < 0.2:
+                current ^= {rng.choice(FORMATTING_TAGS)}
+            text.append(rng.choice(ALPHABET))
+            tags.append(frozenset(current))
+        text.append("\n\n")
+        tags += [frozenset(), frozenset()]
+    return "".join(text), tags
+
+
+def to_segments(tags: list) -> list:
+    """Turn the tags of every character into (end offset, tags) segments."""
+    segments = []
+    for offset, character_tags in enumerate(tags):
+        if len(segments) > 0 and segments[-1][1] == character_tags:
+            segments[-1] = (offset + 1, character_tags)
+        else:
+            segments.append((offset + 1, character_tags))
+    return [(end, set(character_tags)) for end, character_tags in segments]
+
+
+def from_spans(length: int, spans: list) -> list:
+    """Turn (tag, start, end) spans into the tags of every character."""
+    tags = [set() for _ in range(length)]
+    for name, start, end in spans:
+        for offset in range(start, end):
+            tags[offset].add(name)
+    return [frozenset(character_tags) for character_tags in tags]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_round_trip(seed):
+    text, tags = random_formatted_text(random.Random(seed))
+
+    html_content = text_to_html(text, to_segments(tags))
+    parsed_text, spans = parse_html(html_content)
+
+    assert parsed_text == text
+    assert from_spans(len(parsed_text), spans) == tags
+
+
+def test_nested_tags():
+    text = "plain italic both\n\n"
+    segments = [(6, set()), (13, {"em"}), (17, {"em", "strong"}), (19, set())]
+
+    html_content = text_to_html(text, segments)
+
+    assert html_content == (
+        '<p class="first-paragraph">plain <em>italic '
+        '<strong>both</strong></em></p>\n'
+    )
+    assert parse_html(html_content) == (
+        text, [("strong", 13, 17), ("em", 6, 17)]
+    )
+
+
+def test_escaped_characters():
+    text = "a < b && c > d\n\n"
+
+    html_content = text_to_html(text, [(len(text), set())])
+
+    assert "&lt;" in html_content and "&amp;&amp;" in html_content
+    assert parse_html(html_content)[0] == text
@@ -0,0 +1,76 @@
+# tests/test_language_tool.py
+#
+# Copyright 2025 Christophe Gueret
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Checks of the paragraphs of scenes against LanguageTool."""
+
+import pytest
+
+# The checker lives next to the client of the server, which needs Soup
+language_tool = pytest.importorskip("scriptorium.language_tool")
+
+
+class FakeCache(object):
+    """A cache of check results which never knows anything."""
+
+    def get_many(self, _language, _paragraphs) -> dict:
+        return {}
+
+    def put_many(self, _language, _results):
+        pass
+
+
+class FakeLanguageTool(object):
+    """Record the texts sent for checking, without finding anything."""
+
+    def __init__(self, server_is_alive: bool):
+        self.server_is_alive = server_is_alive
+        self.cache = FakeCache()
+        self.sent = []
+
+    def check(self, text, _language, callback, document=None):
+        self.sent.append(text)
+        callback([])
+
+
+def test_paragraphs_are_sent_once_the_server_is_up():
+    server = FakeLanguageTool(server_is_alive=False)
+    checker = language_tool.ParagraphChecker(server, "en-GB")
+    paragraphs = [(0, "First paragraph."), (18, "Second paragraph.")]
+
+    # Nothing can be checked while the server is starting, the paragraphs
+    # are given back to check them later
+    received = []
+    unchecked = checker.check(
+        paragraphs, lambda *checked: received.append(checked)
+    )
+    assert server.sent == []
+    assert unchecked == paragraphs
+    assert received == [([], [])]
+
+    # But everything is sent as soon as it is there
+    server.server_is_alive = True
+    unchecked = checker.check(
+        paragraphs, lambda *checked: received.append(checked)
+    )
+    assert server.sent == ["First paragraph.\n\nSecond paragraph."]
+    assert unchecked == []
+    assert received[-1] == (paragraphs, [])
+
+    # And not again once checked
+    checker.check(paragraphs, lambda *checked: received.append(checked))
+    assert len(server.sent) == 1
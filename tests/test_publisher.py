@@ -0,0 +1,93 @@
+# tests/test_publisher.py
+#
+# Copyright 2025 Christophe Gueret
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Books written part by part against books built in memory."""
+
+import re
+import zipfile
+from pathlib import Path
+
+import pytest
+
+# The publisher needs the models, and so Gtk, along with ebooklib
+pytest.importorskip("ebooklib")
+publisher = pytest.importorskip("scriptorium.utils.publisher")
+models = pytest.importorskip("scriptorium.models")
+
+# The style is a resource of the application, not registered in the tests
+STYLE_PATH = Path(publisher.__file__).parent / "epub-novel.css"
+
+# The time the book was written at is the only thing expected to differ
+MODIFIED = re.compile(rb'<meta property="dcterms:modified">[^<]*</meta>')
+
+
+@pytest.fixture
+def manuscript(tmp_path):
+    """A manuscript with two chapters, one of them holding a sub chapter."""
+    project = models.Project(tmp_path / "project")
+    manuscript = project.create_resource(models.Manuscript, "The Book")
+    project.manuscript = manuscript
+
+    for chapter_number in range(2):
+        chapter = project.create_resource(
+            models.Chapter, f"Chapter {chapter_number}"
+        )
+        manuscript.add_resource(chapter)
+        for scene_number in range(3):
+            scene = project.create_resource(
+                models.Scene, f"Scene {chapter_number}.{scene_number}"
+            )
+            scene.data_files[0].write_text(
+                f"<p>Text of scene {chapter_number}.{scene_number} "
+                "&amp; more.</p>\n"
+            )
+            chapter.add_scene(scene)
+
+    section = project.create_resource(models.Chapter, "Section")
+    chapter.content.append(section)
+    scene = project.create_resource(models.Scene, "Last scene")
+    scene.data_files[0].write_text("<p>The end.</p>\n")
+    section.add_scene(scene)
+
+    return manuscript
+
+
+def read_entries(path: Path) -> dict:
+    with zipfile.ZipFile(path) as archive:
+        return {
+            name: MODIFIED.sub(b"", archive.read(name))
+            for name in archive.namelist()
+        }
+
+
+def test_streamed_book_is_the_book_built(manuscript, tmp_path, monkeypatch):
+    monkeypatch.setattr(publisher, "load_style", STYLE_PATH.read_text)
+
+    built = publisher.Publisher(manuscript)
+    built._build()
+    publisher.epub.write_epub(
+        str(tmp_path / "built.epub"), built._book, publisher.WRITE_OPTIONS
+    )
+
+    publisher.Publisher(manuscript).save(str(tmp_path / "streamed.epub"))
+
+    built_entries = read_entries(tmp_path / "built.epub")
+    streamed_entries = read_entries(tmp_path / "streamed.epub")
+    assert list(streamed_entries) == list(built_entries)
+    for name, content in built_entries.items():
+        assert streamed_entries[name] == content, name